@@ -0,0 +1,107 @@
+"""
+Database size and read latency with raw vs. compressed publication content
+
+Run from the workshop3 directory:
+    python -m benchmarks.compression --publications 5000 --paragraphs 20
+"""
+
+import argparse
+import asyncio
+import contextlib
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+from db import DatabaseService, SQLiteProfile
+from db_models import ContentCodec, zstandard
+from passwords import PBKDF2Hasher
+
+WORDS = (
+    "the of and to in is that for it as with was on be by this are from or at "
+    "python sqlite database compression latency article publication content page "
+    "index query storage reader writer cache memory disk throughput benchmark"
+).split()
+
+
+def article(rng: random.Random, paragraphs: int) -> str:
+    """Synthetic article of `paragraphs` paragraphs with ~80 words each"""
+    return "\n\n".join(
+        " ".join(rng.choice(WORDS) for _ in range(80)).capitalize() + "."
+        for _ in range(paragraphs)
+    )
+
+
+async def measure(
+    codec: ContentCodec | None, publications: int, paragraphs: int, reads: int
+) -> dict[str, float]:
+    """Seed a fresh database and return its size and read latencies"""
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "bench.db")
+        db = DatabaseService(
+            f"sqlite+aiosqlite:///{path}",
+            password_hasher=PBKDF2Hasher(iterations=1),
+            sqlite_profile=SQLiteProfile(),
+            content_codec=codec,
+        )
+        with contextlib.redirect_stdout(sys.stderr):
+            await db.create_tables()
+        owner = await db.create_user("writer", "writer@example.com", "x")
+        rng = random.Random(42)
+        publication_ids = await db.create_publications_bulk(
+            {
+                "title": f"Article {i}",
+                "content": article(rng, paragraphs),
+                "owner_id": owner.id,
+            }
+            for i in range(publications)
+        )
+        async with db.engine.connect() as conn:
+            await conn.exec_driver_sql("PRAGMA wal_checkpoint(TRUNCATE)")
+
+        get_latencies = []
+        for _ in range(reads):
+            start = time.perf_counter()
+            await db.get_publication(rng.choice(publication_ids))
+            get_latencies.append(time.perf_counter() - start)
+        list_latencies = []
+        for _ in range(max(reads // 10, 1)):
+            start = time.perf_counter()
+            await db.get_all_publications(
+                after_id=rng.randrange(max(publications - 100, 1)), limit=100
+            )
+            list_latencies.append(time.perf_counter() - start)
+        await db.close()
+        size = os.path.getsize(path)
+    return {
+        "size_mb": size / 1024 / 1024,
+        "get_ms": statistics.median(get_latencies) * 1000,
+        "list_ms": statistics.median(list_latencies) * 1000,
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--publications", type=int, default=5_000)
+    parser.add_argument("--paragraphs", type=int, default=20)
+    parser.add_argument("--reads", type=int, default=2_000)
+    parser.add_argument("--threshold", type=int, default=1024)
+    args = parser.parse_args()
+
+    codecs = {"raw": None, "zlib": ContentCodec("zlib", args.threshold)}
+    if zstandard is not None:
+        codecs["zstd"] = ContentCodec("zstd", args.threshold)
+
+    print(f"{'codec':>6} {'size MB':>9} {'get p50 ms':>11} {'list p50 ms':>12}")
+    for name, codec in codecs.items():
+        result = await measure(codec, args.publications, args.paragraphs, args.reads)
+        print(
+            f"{name:>6} {result['size_mb']:9.1f} "
+            f"{result['get_ms']:11.3f} {result['list_ms']:12.3f}"
+        )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
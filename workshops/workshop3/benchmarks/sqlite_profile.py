@@ -0,0 +1,86 @@
+"""
+Mixed read/write throughput with SQLite defaults vs. SQLiteProfile PRAGMAs
+
+Run from the workshop3 directory:
+    python -m benchmarks.sqlite_profile --operations 5000 --concurrency 16
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import tempfile
+import time
+
+from db import DatabaseService, SQLiteProfile
+from passwords import PBKDF2Hasher
+
+USERS = 100
+PUBLICATIONS = 2_000
+
+
+async def run_workload(
+    profile: SQLiteProfile | None, operations: int, concurrency: int, write_ratio: float
+) -> float:
+    """Run the workload on a fresh database file and return operations per second"""
+    with tempfile.TemporaryDirectory() as directory:
+        db = DatabaseService(
+            f"sqlite+aiosqlite:///{os.path.join(directory, 'bench.db')}",
+            password_hasher=PBKDF2Hasher(iterations=1),
+            sqlite_profile=profile,
+        )
+        await db.create_tables()
+        user_ids = await db.create_users_bulk(
+            {"username": f"user{i}", "email": f"user{i}@example.com", "password": "x"}
+            for i in range(USERS)
+        )
+        publication_ids = await db.create_publications_bulk(
+            {
+                "title": f"Title {i}",
+                "content": "Lorem ipsum " * 50,
+                "owner_id": random.choice(user_ids),
+            }
+            for i in range(PUBLICATIONS)
+        )
+
+        rng = random.Random(42)
+        remaining = operations
+
+        async def worker():
+            nonlocal remaining
+            while remaining > 0:
+                remaining -= 1
+                if rng.random() < write_ratio:
+                    await db.create_publication(
+                        "New title", "New content", rng.choice(user_ids)
+                    )
+                elif rng.random() < 0.5:
+                    await db.get_publication(rng.choice(publication_ids))
+                else:
+                    await db.get_publications_by_owner(rng.choice(user_ids), limit=20)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+        await db.close()
+    return operations / elapsed
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--operations", type=int, default=5_000)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--write-ratio", type=float, default=0.2)
+    args = parser.parse_args()
+
+    results = {}
+    for name, profile in [("defaults", None), ("profile", SQLiteProfile())]:
+        results[name] = await run_workload(
+            profile, args.operations, args.concurrency, args.write_ratio
+        )
+        print(f"{name:>10}: {results[name]:10.1f} ops/s")
+    print(f"{'speedup':>10}: {results['profile'] / results['defaults']:10.2f}x")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,82 @@
+"""
+Python-side cost per lookup of a select() built per call vs. a pre-built statement
+
+Both variants run the same query on the same session, so the difference is the
+time spent building the statement and its cache key, not in SQLite.
+
+Run from the workshop3 directory:
+    python -m benchmarks.statement_cache --lookups 20000
+"""
+
+import argparse
+import asyncio
+import contextlib
+import sys
+import time
+
+from sqlalchemy import select
+
+from db import DatabaseService, _select_publication_by_id, _select_user_by
+from db_models import Publication, User
+from passwords import PBKDF2Hasher
+
+
+async def per_lookup_us(execute, lookups: int, ids: list[int]) -> float:
+    """Median of three runs, in microseconds per lookup"""
+    runs = []
+    for _ in range(3):
+        start = time.perf_counter()
+        for i in range(lookups):
+            (await execute(ids[i % len(ids)])).scalar_one_or_none()
+        runs.append((time.perf_counter() - start) / lookups * 1e6)
+    return sorted(runs)[1]
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--lookups", type=int, default=20_000)
+    args = parser.parse_args()
+
+    db = DatabaseService(
+        "sqlite+aiosqlite:///:memory:", password_hasher=PBKDF2Hasher(iterations=1)
+    )
+    with contextlib.redirect_stdout(sys.stderr):
+        await db.create_tables()
+    user_ids = await db.create_users_bulk(
+        {"username": f"user{i}", "email": f"user{i}@example.com", "password": "x"}
+        for i in range(100)
+    )
+    publication_ids = await db.create_publications_bulk(
+        {"title": "Title", "content": "Content", "owner_id": user_id}
+        for user_id in user_ids
+    )
+
+    async with db.read_session() as session:
+        cases = {
+            "user by id": (
+                user_ids,
+                lambda value: session.execute(select(User).where(User.id == value)),
+                lambda value: session.execute(_select_user_by["id"], {"value": value}),
+            ),
+            "publication by id": (
+                publication_ids,
+                lambda value: session.execute(
+                    select(Publication).where(Publication.id == value)
+                ),
+                lambda value: session.execute(
+                    _select_publication_by_id, {"publication_id": value}
+                ),
+            ),
+        }
+        print(f"{'lookup':>18} {'per call us':>12} {'pre-built us':>13} {'saved':>7}")
+        for name, (ids, per_call, pre_built) in cases.items():
+            built = await per_lookup_us(per_call, args.lookups, ids)
+            cached = await per_lookup_us(pre_built, args.lookups, ids)
+            print(f"{name:>18} {built:12.1f} {cached:13.1f} {1 - cached / built:7.1%}")
+
+    print(f"compiled cache: {db.metrics.compilation_stats()}")
+    await db.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
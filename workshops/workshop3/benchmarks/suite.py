@@ -0,0 +1,219 @@
+"""
+DatabaseService benchmark suite: read-heavy, write-heavy and mixed workloads
+Seeds synthetic users and publications into in-memory and file-backed SQLite and
+prints throughput and p50/p95/p99 latency per database and workload as JSON.
+The in-memory database always runs one operation at a time
+
+Run from the workshop3 directory:
+    python -m benchmarks.suite --users 10000 --publications 1000000 --output bench.json
+"""
+
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+import sqlalchemy
+
+from db import DatabaseService, SQLiteProfile, sqlite_read_only_url
+from passwords import PBKDF2Hasher
+
+# share of write operations in each workload
+WORKLOADS = {"read-heavy": 0.05, "write-heavy": 0.8, "mixed": 0.5}
+DATABASES = ["memory", "file"]
+
+WORDS = (
+    "python sqlite async database index query cache latency throughput "
+    "workshop flask fastapi session transaction cursor batch stream"
+).split()
+
+
+def synthetic_text(rng: random.Random, words: int) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(words))
+
+
+def create_service(database: str, directory: str) -> DatabaseService:
+    """DatabaseService configured like the apps, for an in-memory or a file database"""
+    # the benchmark measures the database, not the password hashing work factor
+    password_hasher = PBKDF2Hasher(iterations=1)
+    if database == "memory":
+        return DatabaseService(
+            "sqlite+aiosqlite:///:memory:",
+            password_hasher=password_hasher,
+            sqlite_profile=SQLiteProfile(),
+        )
+    url = f"sqlite+aiosqlite:///{os.path.join(directory, 'bench.db')}"
+    return DatabaseService(
+        url,
+        password_hasher=password_hasher,
+        sqlite_profile=SQLiteProfile(),
+        read_database_url=sqlite_read_only_url(url),
+    )
+
+
+async def seed(
+    db: DatabaseService, users: int, publications: int, rng: random.Random
+) -> tuple[list[int], list[int]]:
+    """Create the synthetic data set and return the user and publication IDs"""
+    user_ids = await db.create_users_bulk(
+        {"username": f"user{i}", "email": f"user{i}@example.com", "password": "x"}
+        for i in range(users)
+    )
+    publication_ids = await db.create_publications_bulk(
+        (
+            {
+                "title": synthetic_text(rng, 5),
+                "content": synthetic_text(rng, 50),
+                "owner_id": rng.choice(user_ids),
+            }
+            for _ in range(publications)
+        ),
+        batch_size=10_000,
+    )
+    return user_ids, publication_ids
+
+
+def percentiles(latencies: list[float]) -> dict[str, float]:
+    """p50/p95/p99 in milliseconds"""
+    cut_points = statistics.quantiles(latencies, n=100, method="inclusive")
+    return {f"p{p}": round(cut_points[p - 1] * 1000, 3) for p in (50, 95, 99)}
+
+
+async def run_workload(
+    db: DatabaseService,
+    user_ids: list[int],
+    publication_ids: list[int],
+    write_ratio: float,
+    operations: int,
+    concurrency: int,
+    seed_value: int,
+) -> dict:
+    """Run `operations` random calls from `concurrency` tasks and measure each one"""
+    rng = random.Random(seed_value)
+
+    async def read():
+        choice = rng.random()
+        if choice < 0.3:
+            await db.get_user(rng.choice(user_ids))
+        elif choice < 0.5:
+            await db.get_user_by_username(f"user{rng.randrange(len(user_ids))}")
+        elif choice < 0.8:
+            await db.get_publication(rng.choice(publication_ids))
+        else:
+            await db.get_publications_by_owner(rng.choice(user_ids), limit=20)
+
+    async def write():
+        if rng.random() < 0.7:
+            await db.create_publication(
+                synthetic_text(rng, 5), synthetic_text(rng, 50), rng.choice(user_ids)
+            )
+        else:
+            await db.update_publication(
+                rng.choice(publication_ids), title=synthetic_text(rng, 5)
+            )
+
+    latencies: list[float] = []
+    remaining = operations
+
+    async def worker():
+        nonlocal remaining
+        while remaining > 0:
+            remaining -= 1
+            operation = write if rng.random() < write_ratio else read
+            start = time.perf_counter()
+            await operation()
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    return {
+        "operations": operations,
+        "seconds": round(elapsed, 3),
+        "throughput": round(operations / elapsed, 1),
+        "latency_ms": percentiles(latencies),
+    }
+
+
+async def run_suite(args: argparse.Namespace) -> dict:
+    results = []
+    for database in args.databases:
+        with tempfile.TemporaryDirectory() as directory:
+            db = create_service(database, directory)
+            # keep stdout valid JSON
+            with contextlib.redirect_stdout(sys.stderr):
+                await db.create_tables()
+            rng = random.Random(args.seed)
+            start = time.perf_counter()
+            user_ids, publication_ids = await seed(
+                db, args.users, args.publications, rng
+            )
+            seed_seconds = round(time.perf_counter() - start, 3)
+            # every session of an in-memory database shares its single connection,
+            # so concurrent transactions would interleave on it
+            concurrency = 1 if database == "memory" else args.concurrency
+            for workload in args.workloads:
+                result = await run_workload(
+                    db,
+                    user_ids,
+                    publication_ids,
+                    WORKLOADS[workload],
+                    args.operations,
+                    concurrency,
+                    args.seed,
+                )
+                results.append(
+                    {
+                        "database": database,
+                        "workload": workload,
+                        "concurrency": concurrency,
+                        "seed_seconds": seed_seconds,
+                        **result,
+                    }
+                )
+            await db.close()
+    return {
+        "config": {
+            "users": args.users,
+            "publications": args.publications,
+            "operations": args.operations,
+            "concurrency": args.concurrency,
+            "seed": args.seed,
+            "python": platform.python_version(),
+            "sqlalchemy": sqlalchemy.__version__,
+        },
+        "results": results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--users", type=int, default=10_000)
+    parser.add_argument("--publications", type=int, default=100_000)
+    parser.add_argument("--operations", type=int, default=10_000)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--databases", nargs="+", choices=DATABASES, default=DATABASES)
+    parser.add_argument(
+        "--workloads", nargs="+", choices=list(WORKLOADS), default=list(WORKLOADS)
+    )
+    parser.add_argument("--output", help="Write the JSON report to a file")
+    args = parser.parse_args()
+
+    report = json.dumps(asyncio.run(run_suite(args)), indent=2)
+    if args.output:
+        with open(args.output, "w") as output:
+            output.write(report + "\n")
+    else:
+        print(report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+"""
+Sustained create_publication rate with per-call commits vs. the write-behind queue
+
+Run from the workshop3 directory:
+    python -m benchmarks.write_behind --inserts 10000 --concurrency 100
+"""
+
+import argparse
+import asyncio
+import contextlib
+import os
+import sys
+import tempfile
+import time
+
+from db import DatabaseService, SQLiteProfile
+from passwords import PBKDF2Hasher
+
+
+async def insert_rate(write_behind_batch_size: int, inserts: int, concurrency: int):
+    """Inserts per second and failed inserts on a fresh database file"""
+    with tempfile.TemporaryDirectory() as directory:
+        db = DatabaseService(
+            f"sqlite+aiosqlite:///{os.path.join(directory, 'bench.db')}",
+            password_hasher=PBKDF2Hasher(iterations=1),
+            sqlite_profile=SQLiteProfile(),
+            write_behind_batch_size=write_behind_batch_size,
+        )
+        with contextlib.redirect_stdout(sys.stderr):
+            await db.create_tables()
+        owner = await db.create_user("writer", "writer@example.com", "x")
+        remaining = inserts
+        errors = 0
+
+        async def worker():
+            nonlocal remaining, errors
+            while remaining > 0:
+                remaining -= 1
+                try:
+                    await db.create_publication("Title", "Content " * 50, owner.id)
+                except Exception:
+                    errors += 1
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+        await db.close()
+    return inserts / elapsed, errors
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--inserts", type=int, default=10_000)
+    parser.add_argument("--concurrency", type=int, default=100)
+    parser.add_argument("--batch-size", type=int, default=500)
+    args = parser.parse_args()
+
+    results = {}
+    for name, batch_size in [("per-call", 0), ("write-behind", args.batch_size)]:
+        rate, errors = await insert_rate(batch_size, args.inserts, args.concurrency)
+        results[name] = rate
+        print(f"{name:>12}: {rate:10.1f} inserts/s ({errors} errors)")
+    print(f"{'speedup':>12}: {results['write-behind'] / results['per-call']:10.2f}x")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
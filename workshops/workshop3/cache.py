@@ -0,0 +1,115 @@
+"""
+In-process LRU cache with per-entry time-to-live
+Used by DatabaseService to keep hot lookups away from the database
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Hashable
+
+
+class TTLCache:
+    """Least-recently-used cache whose entries also expire after `ttl` seconds"""
+
+    def __init__(
+        self,
+        maxsize: int = 1024,
+        ttl: float = 60.0,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        """
+        Args:
+            maxsize: Maximum number of entries before the least recently used is dropped
+            ttl: Seconds an entry stays valid after it was stored
+            clock: Time source (replaceable in tests)
+        """
+        if maxsize < 1:
+            raise ValueError("maxsize must be at least 1")
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._clock = clock
+        # key -> (expires at, value, tag)
+        self._entries: OrderedDict[Hashable, tuple[float, Any, Hashable]] = (
+            OrderedDict()
+        )
+        # tag -> keys of the entries stored with it, for pop_tag
+        self._tagged: dict[Hashable, set[Hashable]] = {}
+        # Flask serves requests from several threads
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Hashable) -> Any | None:
+        """Return the cached value (counting a hit) or None (counting a miss)"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, value, _ = entry
+                if expires_at > self._clock():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                self._remove(key)
+            self.misses += 1
+            return None
+
+    def set(self, key: Hashable, value: Any, tag: Hashable = None):
+        """
+        Store a value, evicting the least recently used entry when full
+        Entries stored with a `tag` (not None) can be removed together by pop_tag
+        """
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (self._clock() + self.ttl, value, tag)
+            if tag is not None:
+                self._tagged.setdefault(tag, set()).add(key)
+            while len(self._entries) > self.maxsize:
+                self._remove(next(iter(self._entries)))
+
+    def pop(self, key: Hashable) -> Any | None:
+        """Remove an entry and return its value (None if absent)"""
+        with self._lock:
+            entry = self._remove(key)
+        return entry[1] if entry is not None else None
+
+    def pop_tag(self, tag: Hashable) -> int:
+        """
+        Remove every entry stored with `tag`, without scanning the others
+        Returns:
+            Number of removed entries
+        """
+        with self._lock:
+            keys = self._tagged.pop(tag, ())
+            for key in keys:
+                del self._entries[key]
+        return len(keys)
+
+    def clear(self):
+        """Remove all entries (counters are kept)"""
+        with self._lock:
+            self._entries.clear()
+            self._tagged.clear()
+
+    def _remove(self, key: Hashable) -> tuple[float, Any, Hashable] | None:
+        """Remove an entry and its tag index entry (the caller holds the lock)"""
+        entry = self._entries.pop(key, None)
+        if entry is not None and entry[2] is not None:
+            keys = self._tagged[entry[2]]
+            keys.discard(key)
+            if not keys:
+                del self._tagged[entry[2]]
+        return entry
+
+    def stats(self) -> dict[str, int]:
+        """Hit/miss counters and current size, useful for sizing the cache"""
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+        }
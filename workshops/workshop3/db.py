@@ -3,32 +3,361 @@ Async Database Module with CRUD Operations
 Reusable by both Flask and FastAPI applications
 """
 
-import hashlib
-from typing import Sequence
+import asyncio
+import hmac
+import os
+import re
+import secrets
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+from functools import partial
+from itertools import islice
+from typing import Any, AsyncIterator, Callable, Iterable, Iterator, Mapping, Sequence
+import aiosqlite
 from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine, async_sessionmaker
 from sqlalchemy.future import select
-from sqlalchemy import delete
-from db_models import Base, User, Publication
+from sqlalchemy import (
+    LargeBinary,
+    and_,
+    bindparam,
+    cast,
+    column,
+    delete,
+    event,
+    func,
+    insert,
+    make_url,
+    table,
+    text,
+    update,
+)
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import defer
+from cache import TTLCache
+from loader import BatchLoader
+from write_queue import WriteBehindQueue
+from db_models import Base, ContentCodec, User, Publication
+from metrics import QueryMetrics, count_statement, instrumented, render_cache_metrics
+from migrations import migrate, reset_migrations, use_search_triggers
+from passwords import PasswordHasher, PBKDF2Hasher, verify_password
+
+
+class UserAlreadyExists(Exception):
+    """A unique user field is already taken by another user"""
+
+
+class UsernameTaken(UserAlreadyExists):
+    """The username is already taken"""
+
+
+class EmailTaken(UserAlreadyExists):
+    """The email is already taken"""
+
+
+class VersionConflict(Exception):
+    """A conditional update found the publication at another version"""
+
+    def __init__(self, current_version: int):
+        super().__init__(current_version)
+        self.current_version = current_version
+
+
+@dataclass(frozen=True)
+class SQLiteProfile:
+    """PRAGMAs applied to every new SQLite connection"""
+
+    # readers don't block the writer and commits append to the log instead of
+    # rewriting pages; NORMAL only fsyncs at checkpoints, which is safe with WAL
+    journal_mode: str = "WAL"
+    synchronous: str = "NORMAL"
+    mmap_size: int = 256 * 1024 * 1024
+    cache_size: int = -64_000  # negative values are KiB, i.e. ~64 MB per connection
+    temp_store: str = "MEMORY"
+    busy_timeout: int = 5_000  # milliseconds to wait for a lock before failing
+
+    def pragmas(self, read_only: bool = False) -> list[str]:
+        """PRAGMA statements (the journal mode can only be changed by a writer)"""
+        journal_mode = [] if read_only else [f"PRAGMA journal_mode={self.journal_mode}"]
+        return journal_mode + [
+            f"PRAGMA synchronous={self.synchronous}",
+            f"PRAGMA mmap_size={self.mmap_size}",
+            f"PRAGMA cache_size={self.cache_size}",
+            f"PRAGMA temp_store={self.temp_store}",
+            f"PRAGMA busy_timeout={self.busy_timeout}",
+        ]
+
+
+def _apply_pragmas(pragmas: list[str], dbapi_connection, connection_record):
+    """Engine "connect" event handler running the PRAGMAs on a new connection"""
+    cursor = dbapi_connection.cursor()
+    for pragma in pragmas:
+        cursor.execute(pragma)
+    cursor.close()
+
+
+def _register_functions(dbapi_connection, connection_record):
+    """Engine "connect" event handler adding the SQL functions used by triggers"""
+    dbapi_connection.create_function(
+        "publication_content", 1, ContentCodec.decode, deterministic=True
+    )
+
+
+def sqlite_read_only_url(database_url: str) -> str:
+    """
+    Read-only variant of a file-based SQLite URL, e.g. for `read_database_url`
+    "sqlite+aiosqlite:///./workshop.db" -> "sqlite+aiosqlite:///file:./workshop.db?mode=ro&uri=true"
+    """
+    url = make_url(database_url)
+    return f"{url.drivername}:///file:{url.database}?mode=ro&uri=true"
+
+
+# FTS5 index maintained by the triggers from migrations.py
+publications_fts = table("publications_fts", column("rowid"), column("rank"))
+
+
+def _fts_match_query(query: str) -> str:
+    """
+    Turn free text into an FTS5 query that matches all of its words
+    Every word is quoted, so characters like `"`, `*` or `-` in user input can't
+    produce FTS5 syntax errors
+    """
+    return " ".join(f'"{word}"' for word in re.findall(r"\w+", query))
+
+
+def _batched(items: Iterable[Any], batch_size: int) -> Iterator[list[Any]]:
+    """Split an iterable into lists of at most `batch_size` items"""
+    if batch_size < 1:
+        raise ValueError("batch_size must be at least 1")
+    iterator = iter(items)
+    while batch := list(islice(iterator, batch_size)):
+        yield batch
+
+
+def _paginate(query, id_column, skip: int, limit: int, after_id: int | None):
+    """Apply offset or keyset (`id > after_id`) pagination to a query ordered by id"""
+    query = query.order_by(id_column).limit(limit)
+    if after_id is not None:
+        return query.where(id_column > after_id)
+    return query.offset(skip)
+
+
+def _select_publications(summary: bool = False):
+    """SELECT of publications, without the (large) content column in summary mode"""
+    query = select(Publication)
+    if summary:
+        query = query.options(defer(Publication.content, raiseload=True))
+    return query
+
+
+# Statements of the hot lookups, built once with their values as bound parameters.
+# Building a select() and its cache key costs more Python time per call than
+# executing the compiled form SQLAlchemy caches for it
+_select_user_by = {
+    field: select(User).where(getattr(User, field) == bindparam("value"))
+    for field in ("id", "username", "email")
+}
+_select_users_in = {
+    field: select(User).where(
+        getattr(User, field).in_(bindparam("values", expanding=True))
+    )
+    for field in ("id", "username")
+}
+_select_publication_by_id = select(Publication).where(
+    Publication.id == bindparam("publication_id")
+)
+
+
+def next_cursor(page: Sequence[User | Publication], limit: int) -> int | None:
+    """
+    Cursor for the page following `page`
+    Returns:
+        ID of the last row to pass as `after_id`, or None if this is the last page
+    """
+    if not page or len(page) < limit:
+        return None
+    return page[-1].id
+
+
+def publication_etag(publication: Publication) -> str:
+    """Strong HTTP ETag of a publication's version, e.g. '"3"'"""
+    return f'"{publication.version}"'
+
+
+def etag_version(etag: str) -> int:
+    """
+    Publication version of an If-Match ETag made by `publication_etag`
+    Raises:
+        ValueError: For weak, malformed or several ETags, none of which can match
+    """
+    etag = etag.strip()
+    if len(etag) < 3 or etag[0] != '"' or etag[-1] != '"' or not etag[1:-1].isdigit():
+        raise ValueError(f"not a publication ETag: {etag}")
+    return int(etag[1:-1])
+
+
+# users whose last invalidation is remembered (see DatabaseService._mark_invalidated);
+# beyond that one invalidation of every user makes room again
+_MAX_TRACKED_USERS = 10_000
 
 
 class DatabaseService:
     """Async database manager for CRUD operations"""
 
-    def __init__(self, database_url: str = "sqlite+aiosqlite:///./workshop.db"):
+    def __init__(
+        self,
+        database_url: str = "sqlite+aiosqlite:///./workshop.db",
+        user_cache_size: int = 0,
+        user_cache_ttl: float = 60.0,
+        credential_cache_size: int = 0,
+        credential_cache_ttl: float = 30.0,
+        password_hasher: PasswordHasher | None = None,
+        hash_workers: int | None = None,
+        sqlite_profile: SQLiteProfile | None = None,
+        read_database_url: str | None = None,
+        read_pool_size: int = 5,
+        user_batch_size: int = 500,
+        content_codec: ContentCodec | None = None,
+        write_behind_batch_size: int = 0,
+        write_behind_delay: float = 0.005,
+    ):
         """
         Initialize database connection
         Args:
             database_url: SQLAlchemy database URL (must support async)
+            user_cache_size: Max cached user lookups (0 disables the cache).
+                Only safe when this instance is the only writer of the users table.
+            user_cache_ttl: Seconds a cached user stays valid
+            credential_cache_size: Max cached successful logins (0 disables the cache).
+                Logins resolve to users through the user cache, so it needs one
+            credential_cache_ttl: Seconds a verified login is trusted without the database
+            password_hasher: Algorithm and work factor for new password hashes
+                (default: PBKDF2 with 600 000 iterations)
+            hash_workers: Threads for password hashing (default: number of CPUs)
+            sqlite_profile: PRAGMAs for every new connection (default: SQLite defaults)
+            read_database_url: Separate URL for the read-only get_* and
+                authenticate_user queries, e.g. sqlite_read_only_url(database_url)
+                or a replica (default: reads share the primary engine)
+            read_pool_size: Connection pool size of the read engine
+            user_batch_size: Max IDs/usernames that concurrent get_user and
+                get_user_by_username calls share in one query (0 disables batching)
+            content_codec: Compression of long publication content on write
+                (default: stored as is; compressed rows are always readable).
+                While content is compressed, the search triggers call a SQL
+                function that only this class registers, see create_tables
+            write_behind_batch_size: Max create_publication calls committed
+                together by a background writer (0: every call commits on its own).
+                Units of work use it until their first write
+            write_behind_delay: Seconds a queued publication waits for others
+                to share its commit
         """
+        if credential_cache_size and not user_cache_size:
+            raise ValueError("credential_cache_size needs a user_cache_size")
         self.engine = create_async_engine(database_url, echo=False)
+        if sqlite_profile is not None:
+            event.listen(
+                self.engine.sync_engine,
+                "connect",
+                partial(_apply_pragmas, sqlite_profile.pragmas()),
+            )
         self.async_session = async_sessionmaker(
             self.engine, class_=AsyncSession, expire_on_commit=False
         )
 
+        # with WAL, readers on their own connections never queue behind a writer
+        if read_database_url is not None:
+            self.read_engine = create_async_engine(
+                read_database_url, echo=False, pool_size=read_pool_size
+            )
+            if sqlite_profile is not None:
+                event.listen(
+                    self.read_engine.sync_engine,
+                    "connect",
+                    partial(_apply_pragmas, sqlite_profile.pragmas(read_only=True)),
+                )
+        else:
+            self.read_engine = self.engine
+        self.read_session = async_sessionmaker(
+            self.read_engine, class_=AsyncSession, expire_on_commit=False
+        )
+
+        self.metrics = QueryMetrics()
+        for engine in {self.engine, self.read_engine}:
+            event.listen(engine.sync_engine, "before_cursor_execute", count_statement)
+            event.listen(
+                engine.sync_engine,
+                "before_cursor_execute",
+                self.metrics.count_compilation,
+            )
+            # SQLite ignores ON DELETE CASCADE unless every connection enables it
+            if engine.dialect.name == "sqlite":
+                event.listen(
+                    engine.sync_engine,
+                    "connect",
+                    partial(_apply_pragmas, ["PRAGMA foreign_keys=ON"]),
+                )
+                event.listen(engine.sync_engine, "connect", _register_functions)
+
+        # read-through cache keyed by ("id" | "username" | "email", value)
+        self.user_cache = (
+            TTLCache(maxsize=user_cache_size, ttl=user_cache_ttl)
+            if user_cache_size
+            else None
+        )
+        # IDs of verified logins keyed by a salted digest of "username:password"
+        self.credential_cache = (
+            TTLCache(maxsize=credential_cache_size, ttl=credential_cache_ttl)
+            if credential_cache_size
+            else None
+        )
+        self._credential_salt = secrets.token_bytes(16)
+        # bumped on every invalidation so lookups that raced a write don't cache
+        # stale rows: a lookup caches its user unless that user (or every user)
+        # was invalidated after the generation the lookup started at
+        self._user_cache_generation = 0
+        self._user_invalidated_at: dict[int, int] = {}
+        self._users_invalidated_at = 0
+        self.password_hasher = password_hasher or PBKDF2Hasher()
+        # checked against for unknown usernames, made on the first one
+        self._dummy_password_hash: str | None = None
+        self._hash_workers = hash_workers or os.cpu_count()
+        self._hash_executor: ThreadPoolExecutor | None = None
+        self.content_codec = content_codec
+        # group commit of concurrent create_publication calls
+        self.publication_writer = (
+            WriteBehindQueue(
+                self._insert_publications, write_behind_batch_size, write_behind_delay
+            )
+            if write_behind_batch_size
+            else None
+        )
+        # session of the unit_of_work() block the current task runs in
+        self._current_session: ContextVar[AsyncSession | None] = ContextVar(
+            "unit_of_work_session", default=None
+        )
+        # concurrent lookups of the same loop iteration share one IN (...) query
+        self.user_loaders = (
+            {
+                field: BatchLoader(partial(self._load_users, field), user_batch_size)
+                for field in ("id", "username")
+            }
+            if user_batch_size
+            else None
+        )
+
     async def create_tables(self):
-        """Create all tables defined in models"""
+        """
+        Create all tables defined in models and migrate existing ones
+        Also installs the search triggers for the configured `content_codec`:
+        ones that decode compressed content while there is any, otherwise
+        plain ones that other SQLite clients (e.g. a DB viewer) can run
+        """
         async with self.engine.begin() as conn:
             await conn.run_sync(Base.metadata.create_all)
+            await conn.run_sync(migrate)
+            await conn.run_sync(use_search_triggers, self.content_codec is not None)
 
         # preload database with test admin user
         await self._preload_data()
@@ -37,10 +366,85 @@ class DatabaseService:
         """Drop all tables - useful for testing"""
         async with self.engine.begin() as conn:
             await conn.run_sync(Base.metadata.drop_all)
+            await conn.run_sync(reset_migrations)
+        for cache in (self.user_cache, self.credential_cache):
+            if cache is not None:
+                cache.clear()
 
     async def close(self):
         """Close database connection"""
+        if self.publication_writer is not None:
+            await self.publication_writer.close()
         await self.engine.dispose()
+        if self.read_engine is not self.engine:
+            await self.read_engine.dispose()
+        if self._hash_executor is not None:
+            self._hash_executor.shutdown(wait=False)
+            self._hash_executor = None
+
+    # ==================== BACKUP ====================
+
+    @asynccontextmanager
+    async def _sqlite_connection(self) -> AsyncIterator[aiosqlite.Connection]:
+        """aiosqlite connection behind a pooled connection of the write engine"""
+        if self.engine.dialect.driver != "aiosqlite":
+            raise ValueError("backup and restore need an sqlite+aiosqlite database")
+        async with self.engine.connect() as conn:
+            raw_connection = await conn.get_raw_connection()
+            yield raw_connection.driver_connection
+
+    async def backup(
+        self,
+        path: str | os.PathLike,
+        pages_per_step: int = 1024,
+        progress: Callable[[int, int], None] | None = None,
+        step_delay: float = 0.01,
+    ):
+        """
+        Copy the live database to a snapshot file with SQLite's online backup API
+        The copy runs on the connection's worker thread `pages_per_step` pages at a
+        time and releases its read lock for `step_delay` seconds between steps, so
+        writers are never blocked for long. A write made on another connection
+        restarts the copy; a pages_per_step of -1 copies everything in one step
+        Args:
+            path: Snapshot file, replaced if it exists
+            progress: Called on the event loop with (copied pages, total pages)
+                after every step
+            step_delay: Seconds between steps, also waited before retrying a
+                step that found the database locked
+        """
+        if pages_per_step == 0 or pages_per_step < -1:
+            raise ValueError("pages_per_step must be positive or -1")
+        loop = asyncio.get_running_loop()
+
+        def report(status: int, remaining: int, total: int):
+            # called on the worker thread after every step; sqlite3 itself only
+            # sleeps after a step that failed with SQLITE_BUSY or SQLITE_LOCKED
+            if progress is not None:
+                loop.call_soon_threadsafe(progress, total - remaining, total)
+            if remaining and step_delay > 0:
+                time.sleep(step_delay)
+
+        async with self._sqlite_connection() as source:
+            async with aiosqlite.connect(path) as target:
+                await source.backup(
+                    target, pages=pages_per_step, progress=report, sleep=step_delay
+                )
+
+    async def restore(self, path: str | os.PathLike):
+        """
+        Replace the database content with a snapshot made by `backup`, e.g. to
+        start tests from a pre-seeded database instead of seeding each one
+        """
+        if not os.path.exists(path):
+            raise FileNotFoundError(path)
+        async with self._sqlite_connection() as target:
+            async with aiosqlite.connect(path) as snapshot:
+                await snapshot.backup(target)
+        for cache in (self.user_cache, self.credential_cache):
+            if cache is not None:
+                cache.clear()
+        self._mark_invalidated()
 
     async def _preload_data(self):
         """Preload database with initial data"""
@@ -54,8 +458,182 @@ class DatabaseService:
             )
             print("✓ Preloaded database with test_admin user")
 
+    # ==================== UNIT OF WORK ====================
+
+    @asynccontextmanager
+    async def unit_of_work(self) -> AsyncIterator[AsyncSession]:
+        """
+        Bind one session to everything awaited inside the block, e.g. a request
+        The writes of the methods called in the block share its connection and
+        transaction, which is committed at the end or rolled back on an
+        exception. Reads use the read engine and the batch loaders until the
+        block has written, and the block's session after that so they see its
+        own writes. The methods must not run concurrently (asyncio.gather)
+        inside the block. A nested block joins the outer one
+        """
+        session = self._current_session.get()
+        if session is not None:
+            yield session
+            return
+
+        async with self.async_session() as session:
+            token = self._current_session.set(session)
+            try:
+                yield session
+                await session.commit()
+            except BaseException:
+                # detach instead of expiring the loaded rows, they may be cached
+                session.expunge_all()
+                await session.rollback()
+                raise
+            finally:
+                self._current_session.reset(token)
+                for invalidate, args in session.info.pop("invalidations", []):
+                    invalidate(*args)
+
+    @asynccontextmanager
+    async def _session(self, write: bool = False) -> AsyncIterator[AsyncSession]:
+        """
+        The unit of work's session for writes and for reads after its first
+        write, otherwise a new one (on the read engine unless `write`)
+        """
+        session = self._current_session.get()
+        if session is not None and (write or self._has_uncommitted_writes()):
+            yield session
+            return
+        session_factory = self.async_session if write else self.read_session
+        async with session_factory() as session:
+            yield session
+
+    async def _commit(self, session: AsyncSession):
+        """Commit a write, unless the unit of work owning the session commits it later"""
+        if session is self._current_session.get():
+            session.info["uncommitted_writes"] = True
+        else:
+            await session.commit()
+
+    def _has_uncommitted_writes(self) -> bool:
+        """Whether rows read now may not be committed yet (and must not be cached)"""
+        session = self._current_session.get()
+        return session is not None and session.info.get("uncommitted_writes", False)
+
+    # ==================== USER CACHE ====================
+
+    def _cached_user(self, field: str, value) -> User | None:
+        """Look up a user in the cache by "id", "username" or "email" """
+        if self.user_cache is None:
+            return None
+        return self.user_cache.get((field, value))
+
+    def _cache_user(self, user: User | None, generation: int):
+        """Cache a freshly loaded user unless it was invalidated while loading"""
+        if (
+            self.user_cache is None
+            or user is None
+            or self._invalidated_since(user.id, generation)
+            or self._has_uncommitted_writes()
+        ):
+            return
+        for field in ("id", "username", "email"):
+            self.user_cache.set((field, getattr(user, field)), user, tag=user.id)
+
+    def _invalidate_user(self, user_id: int):
+        """Drop every cached entry (and login) of a user after it was changed or deleted"""
+        self._invalidate_cached_user(user_id)
+        if self.credential_cache is not None:
+            self.credential_cache.pop_tag(user_id)
+        self._repeat_after_unit_of_work(self._invalidate_user, user_id)
+
+    def _invalidate_cached_user(self, user_id: int):
+        """Drop the cached user row only, e.g. after its publication count changed"""
+        self._mark_invalidated(user_id)
+        if self.user_cache is not None:
+            self.user_cache.pop_tag(user_id)
+        self._repeat_after_unit_of_work(self._invalidate_cached_user, user_id)
+
+    def _invalidate_cached_users(self):
+        """Drop all cached user rows"""
+        self._mark_invalidated()
+        if self.user_cache is not None:
+            self.user_cache.clear()
+        self._repeat_after_unit_of_work(self._invalidate_cached_users)
+
+    def _mark_invalidated(self, user_id: int | None = None):
+        """Start a new generation in which one user (or every user) was invalidated"""
+        self._user_cache_generation += 1
+        if user_id is not None and len(self._user_invalidated_at) < _MAX_TRACKED_USERS:
+            self._user_invalidated_at[user_id] = self._user_cache_generation
+        else:
+            # forget the per-user generations, every lookup in flight is stale now
+            self._user_invalidated_at.clear()
+            self._users_invalidated_at = self._user_cache_generation
+
+    def _invalidated_since(self, user_id: int, generation: int) -> bool:
+        """Whether a user was invalidated after a lookup started at `generation`"""
+        return (
+            self._users_invalidated_at > generation
+            or self._user_invalidated_at.get(user_id, 0) > generation
+        )
+
+    def _repeat_after_unit_of_work(self, invalidate, *args):
+        """
+        Run an invalidation again when the current unit of work ends, as other
+        requests may cache the old row until its transaction is committed
+        """
+        session = self._current_session.get()
+        if session is not None:
+            session.info.setdefault("invalidations", []).append((invalidate, args))
+
+    def _credential_key(self, username: str, password: str) -> bytes:
+        """Salted digest of the Basic Auth credentials (the password is never stored)"""
+        return hmac.digest(
+            self._credential_salt, f"{username}:{password}".encode(), "sha256"
+        )
+
+    # ==================== METRICS ====================
+
+    def render_metrics(self) -> str:
+        """Query and cache metrics in the Prometheus text format"""
+        caches = {"user": self.user_cache, "credential": self.credential_cache}
+        return self.metrics.render() + render_cache_metrics(
+            {name: cache for name, cache in caches.items() if cache is not None}
+        )
+
+    # ==================== PASSWORD HASHING ====================
+
+    async def _run_hashing(self, fn, *args):
+        """
+        Run a CPU-heavy hashing function in the bounded thread pool
+        hashlib releases the GIL while deriving keys, so threads use all cores
+        and the event loop keeps serving other requests meanwhile
+        """
+        if self._hash_executor is None:
+            self._hash_executor = ThreadPoolExecutor(
+                max_workers=self._hash_workers, thread_name_prefix="password-hash"
+            )
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._hash_executor, fn, *args)
+
+    async def _hash_password(self, password: str) -> str:
+        return await self._run_hashing(self.password_hasher.hash, password)
+
+    async def _verify_password(self, password: str, password_hash: str) -> bool:
+        return await self._run_hashing(verify_password, password, password_hash)
+
+    async def _verify_unknown_user(self, password: str):
+        """
+        Spend the time of a password check on a username that doesn't exist, so
+        the response time doesn't tell which usernames do
+        """
+        if self._dummy_password_hash is None:
+            self._dummy_password_hash = await self._hash_password(
+                secrets.token_urlsafe()
+            )
+        await self._verify_password(password, self._dummy_password_hash)
+
     # ==================== USER CRUD OPERATIONS ====================
 
+    @instrumented
     async def create_user(
         self, username: str, email: str, password: str, is_admin: bool = False
     ) -> User:
@@ -69,101 +647,300 @@ class DatabaseService:
         Returns:
             Created User object
         """
-        async with self.async_session() as session:
-            # Simple password hashing (for demo purposes - use bcrypt/passlib in production)
-            password_hash = hashlib.sha256(password.encode()).hexdigest()
-
-            user = User(
-                username=username,
-                email=email,
-                password_hash=password_hash,
-                is_admin=is_admin,
+        password_hash = await self._hash_password(password)
+        async with self._session(write=True) as session:
+            user = await session.scalar(
+                insert(User)
+                .values(
+                    username=username,
+                    email=email,
+                    password_hash=password_hash,
+                    is_admin=is_admin,
+                )
+                .returning(User)
             )
-            session.add(user)
-            await session.commit()
-            await session.refresh(user)
+            await self._commit(session)
             return user
 
+    @instrumented
+    async def register_user(self, username: str, email: str, password: str) -> User:
+        """
+        Create a new non-admin user with a single INSERT
+        The unique constraints do the duplicate check, so concurrent signups
+        can't both get the same username or email
+        Raises:
+            UsernameTaken: If the username is already used
+            EmailTaken: If the email is already used
+        """
+        try:
+            return await self.create_user(username, email, password, is_admin=False)
+        except IntegrityError as error:
+            message = str(error.orig)
+            if "users.username" in message:
+                raise UsernameTaken(username) from error
+            if "users.email" in message:
+                raise EmailTaken(email) from error
+            raise
+
+    @instrumented
+    async def create_users_bulk(
+        self, users: Iterable[Mapping[str, Any]], batch_size: int = 1000
+    ) -> list[int]:
+        """
+        Create many users in a single transaction
+        Args:
+            users: Records with `username`, `email`, `password` and optional `is_admin`
+            batch_size: Number of rows sent to the database per executemany call
+        Returns:
+            IDs of the created users, in the order of the input records
+        """
+        # hash everything before the transaction starts, so the write lock isn't
+        # held while the password hasher runs
+        batches: list[list[dict[str, Any]]] = []
+        for batch in _batched(users, batch_size):
+            password_hashes = await asyncio.gather(
+                *(self._hash_password(user["password"]) for user in batch)
+            )
+            batches.append(
+                [
+                    {
+                        "username": user["username"],
+                        "email": user["email"],
+                        "password_hash": password_hash,
+                        "is_admin": user.get("is_admin", False),
+                    }
+                    for user, password_hash in zip(batch, password_hashes)
+                ]
+            )
+
+        user_ids: list[int] = []
+        async with self._session(write=True) as session:
+            for rows in batches:
+                result = await session.scalars(insert(User).returning(User.id), rows)
+                # one multi-row INSERT gives its rows ascending IDs in input
+                # order, but RETURNING doesn't promise to list them in that order
+                user_ids.extend(sorted(result.all()))
+            await self._commit(session)
+        return user_ids
+
+    @instrumented
     async def get_user(self, user_id: int) -> User | None:
         """Get user by ID"""
-        async with self.async_session() as session:
-            result = await session.execute(select(User).where(User.id == user_id))
-            return result.scalar_one_or_none()
+        user = self._cached_user("id", user_id)
+        if user is not None:
+            return user
 
+        generation = self._user_cache_generation
+        if self.user_loaders is not None and not self._has_uncommitted_writes():
+            user = await self.user_loaders["id"].load(user_id)
+        else:
+            async with self._session() as session:
+                result = await session.execute(
+                    _select_user_by["id"], {"value": user_id}
+                )
+                user = result.scalar_one_or_none()
+        self._cache_user(user, generation)
+        return user
+
+    @instrumented
     async def get_user_by_username(self, username: str) -> User | None:
         """Get user by username"""
-        async with self.async_session() as session:
-            result = await session.execute(
-                select(User).where(User.username == username)
-            )
-            return result.scalar_one_or_none()
+        user = self._cached_user("username", username)
+        if user is not None:
+            return user
 
+        generation = self._user_cache_generation
+        if self.user_loaders is not None and not self._has_uncommitted_writes():
+            user = await self.user_loaders["username"].load(username)
+        else:
+            async with self._session() as session:
+                result = await session.execute(
+                    _select_user_by["username"], {"value": username}
+                )
+                user = result.scalar_one_or_none()
+        self._cache_user(user, generation)
+        return user
+
+    @instrumented
+    async def _load_users(self, field: str, values: list[Any]) -> dict[Any, User]:
+        """
+        Users of a batch of get_user / get_user_by_username calls in one query
+        Returns:
+            {id or username: User} for the users that exist
+        """
+        async with self.read_session() as session:
+            result = await session.scalars(_select_users_in[field], {"values": values})
+            return {getattr(user, field): user for user in result}
+
+    @instrumented
     async def get_user_by_email(self, email: str) -> User | None:
         """Get user by email"""
-        async with self.async_session() as session:
-            result = await session.execute(select(User).where(User.email == email))
-            return result.scalar_one_or_none()
+        user = self._cached_user("email", email)
+        if user is not None:
+            return user
 
-    async def get_all_users(self, skip: int = 0, limit: int = 100) -> Sequence[User]:
-        """Get all users with pagination"""
-        async with self.async_session() as session:
-            result = await session.execute(select(User).offset(skip).limit(limit))
+        generation = self._user_cache_generation
+        async with self._session() as session:
+            result = await session.execute(_select_user_by["email"], {"value": email})
+            user = result.scalar_one_or_none()
+        self._cache_user(user, generation)
+        return user
+
+    @instrumented
+    async def get_all_users(
+        self, skip: int = 0, limit: int = 100, after_id: int | None = None
+    ) -> Sequence[User]:
+        """
+        Get all users with pagination
+        Args:
+            skip: Number of users to skip (ignored when `after_id` is given)
+            limit: Maximum number of users to return
+            after_id: Return only users with a greater ID (keyset pagination)
+        """
+        async with self._session() as session:
+            result = await session.execute(
+                _paginate(select(User), User.id, skip, limit, after_id)
+            )
             return result.scalars().all()
 
+    async def stream_users(
+        self, batch_size: int = 1000
+    ) -> AsyncIterator[Sequence[User]]:
+        """
+        Yield all users in ID order, `batch_size` at a time
+        Rows are fetched from a server-side cursor while the caller consumes them,
+        so memory use doesn't grow with the table size
+        """
+        # always a session of its own, streamed responses outlive the unit of work
+        async with self.read_session() as session:
+            result = await session.stream(
+                select(User).order_by(User.id).execution_options(yield_per=batch_size)
+            )
+            async for batch in result.scalars().partitions():
+                yield batch
+
+    @instrumented
     async def update_user(self, user_id: int, **kwargs) -> User | None:
         """
-        Update user fields
+        Update user fields with a single UPDATE ... RETURNING statement
         Args:
             user_id: User ID to update
             **kwargs: Fields to update (username, email, password)
         Returns:
             Updated User object or None if not found
         """
-        async with self.async_session() as session:
-            # Hash password if provided
-            if "password" in kwargs:
-                kwargs["password_hash"] = hashlib.sha256(
-                    kwargs.pop("password").encode()
-                ).hexdigest()
+        # Hash password if provided
+        if "password" in kwargs:
+            kwargs["password_hash"] = await self._hash_password(kwargs.pop("password"))
+        if not kwargs:
+            return await self.get_user(user_id)
 
-            result = await session.execute(select(User).where(User.id == user_id))
-            user = result.scalar_one_or_none()
-
-            if user:
-                for key, value in kwargs.items():
-                    setattr(user, key, value)
-                await session.commit()
-                await session.refresh(user)
-            return user
+        async with self._session(write=True) as session:
+            user = await session.scalar(
+                update(User).where(User.id == user_id).values(**kwargs).returning(User)
+            )
+            await self._commit(session)
+        if user is not None:
+            self._invalidate_user(user_id)
+        return user
 
+    @instrumented
     async def delete_user(self, user_id: int) -> bool:
         """
         Delete user by ID
+        Their publications are removed by the database (ON DELETE CASCADE), so
+        this is one statement however many publications the user has
         Returns:
             True if deleted, False if not found
         """
-        async with self.async_session() as session:
+        async with self._session(write=True) as session:
             result = await session.execute(delete(User).where(User.id == user_id))
-            await session.commit()
-            return result.rowcount > 0  # type: ignore
+            await self._commit(session)
+        self._invalidate_user(user_id)
+        return result.rowcount > 0  # type: ignore
 
+    @instrumented
     async def authenticate_user(self, username: str, password: str) -> User | None:
         """
         Authenticate user by username and password
+        Hashes made by another algorithm or work factor (e.g. legacy sha256 ones)
+        are replaced with a hash from the configured hasher on successful login
         Returns:
             User object if credentials are valid, None otherwise
         """
-        async with self.async_session() as session:
-            password_hash = hashlib.sha256(password.encode()).hexdigest()
+        if self.credential_cache is not None:
+            credential_key = self._credential_key(username, password)
+            user_id = self.credential_cache.get(credential_key)
+            if user_id is not None:
+                # served by the user cache unless the row changed since the login
+                user = await self.get_user(user_id)
+                if user is not None:
+                    return user
+
+        generation = self._user_cache_generation
+        async with self._session() as session:
             result = await session.execute(
-                select(User).where(
-                    User.username == username, User.password_hash == password_hash
-                )
+                _select_user_by["username"], {"value": username}
             )
-            return result.scalar_one_or_none()
+            user = result.scalar_one_or_none()
+        if user is None:
+            await self._verify_unknown_user(password)
+            return None
+        if not await self._verify_password(password, user.password_hash):
+            return None
+
+        if self.password_hasher.needs_rehash(user.password_hash):
+            new_hash = await self._hash_password(password)
+            async with self._session(write=True) as session:
+                # only replace the hash we verified, a concurrent password change wins
+                await session.execute(
+                    update(User)
+                    .where(User.id == user.id, User.password_hash == user.password_hash)
+                    .values(password_hash=new_hash)
+                )
+                await self._commit(session)
+            user.password_hash = new_hash
+            self._invalidate_user(user.id)
+
+        if (
+            self.credential_cache is not None
+            and user is not None
+            and not self._invalidated_since(user.id, generation)
+            and not self._has_uncommitted_writes()
+        ):
+            self.credential_cache.set(credential_key, user.id, tag=user.id)
+        self._cache_user(user, generation)
+        return user
+
+    @instrumented
+    async def count_publications(self, owner_id: int | None = None) -> int:
+        """
+        Number of publications, read from the trigger-maintained
+        `users.publication_count` instead of COUNT(*) over `publications`
+        The count of one owner is a single-row read; the total sums the counts
+        of all users, so it costs O(users), not O(publications)
+        Args:
+            owner_id: Count only the publications of this user (0 for unknown users)
+        """
+        async with self._session() as session:
+            if owner_id is not None:
+                count = await session.scalar(
+                    select(User.publication_count).where(User.id == owner_id)
+                )
+            else:
+                # ON DELETE CASCADE removes the publications of deleted users
+                count = await session.scalar(select(func.sum(User.publication_count)))
+        return count or 0
 
     # ==================== PUBLICATION CRUD OPERATIONS ====================
 
+    def _encode_content(self, content: str) -> str | bytes:
+        """Stored form of publication content (compressed if a codec is configured)"""
+        if self.content_codec is None:
+            return content
+        return self.content_codec.encode(content)
+
+    @instrumented
     async def create_publication(
         self,
         title: str,
@@ -172,6 +949,9 @@ class DatabaseService:
     ) -> Publication:
         """
         Create a new publication
+        With write-behind enabled, the insert is committed by the background
+        writer, also inside a unit of work that hasn't written yet (e.g. a
+        request handler), so an error later in that block doesn't roll it back
         Args:
             title: Publication title
             content: Publication content
@@ -179,82 +959,351 @@ class DatabaseService:
         Returns:
             Created Publication object
         """
+        values = {
+            "title": title,
+            "content": self._encode_content(content),
+            "owner_id": owner_id,
+        }
+        # after earlier writes of a unit of work it joins their transaction
+        if self.publication_writer is not None and not self._has_uncommitted_writes():
+            return await self.publication_writer.submit(values)
+
+        async with self._session(write=True) as session:
+            publication = await session.scalar(
+                insert(Publication).values(**values).returning(Publication)
+            )
+            await self._commit(session)
+        # the trigger changed the owner's publication_count
+        self._invalidate_cached_user(owner_id)
+        return publication
+
+    @instrumented
+    async def _insert_publications(
+        self, rows: list[dict[str, Any]]
+    ) -> Sequence[Publication]:
+        """Write a batch of queued create_publication calls in one transaction"""
         async with self.async_session() as session:
-            publication = Publication(
-                title=title,
-                content=content,
-                owner_id=owner_id,
+            result = await session.scalars(
+                insert(Publication).returning(Publication), rows
             )
-            session.add(publication)
+            # back in input order by their ascending IDs (see create_users_bulk)
+            publications = sorted(result.all(), key=lambda publication: publication.id)
             await session.commit()
-            await session.refresh(publication)
-            return publication
+        for owner_id in {row["owner_id"] for row in rows}:
+            self._invalidate_cached_user(owner_id)
+        return publications
 
+    @instrumented
+    async def create_publications_bulk(
+        self, publications: Iterable[Mapping[str, Any]], batch_size: int = 1000
+    ) -> list[int]:
+        """
+        Create many publications in a single transaction
+        Args:
+            publications: Records with `title`, `content` and `owner_id`
+            batch_size: Number of rows sent to the database per executemany call
+        Returns:
+            IDs of the created publications, in the order of the input records
+        """
+        publication_ids: list[int] = []
+        owner_ids: set[int] = set()
+        async with self._session(write=True) as session:
+            for batch in _batched(publications, batch_size):
+                rows = [
+                    {
+                        "title": publication["title"],
+                        "content": self._encode_content(publication["content"]),
+                        "owner_id": publication["owner_id"],
+                    }
+                    for publication in batch
+                ]
+                result = await session.scalars(
+                    insert(Publication).returning(Publication.id), rows
+                )
+                # ascending IDs are in input order (see create_users_bulk)
+                publication_ids.extend(sorted(result.all()))
+                owner_ids.update(row["owner_id"] for row in rows)
+            await self._commit(session)
+        for owner_id in owner_ids:
+            self._invalidate_cached_user(owner_id)
+        return publication_ids
+
+    @instrumented
     async def get_publication(self, publication_id: int) -> Publication | None:
         """Get publication by ID"""
-        async with self.async_session() as session:
+        async with self._session() as session:
             result = await session.execute(
-                select(Publication).where(Publication.id == publication_id)
+                _select_publication_by_id, {"publication_id": publication_id}
             )
             return result.scalar_one_or_none()
 
+    @instrumented
     async def get_all_publications(
-        self, skip: int = 0, limit: int = 100
+        self,
+        skip: int = 0,
+        limit: int = 100,
+        after_id: int | None = None,
+        summary: bool = False,
     ) -> Sequence[Publication]:
-        """Get all publications with pagination"""
-        async with self.async_session() as session:
+        """
+        Get all publications with pagination
+        Args:
+            skip: Number of publications to skip (ignored when `after_id` is given)
+            limit: Maximum number of publications to return
+            after_id: Return only publications with a greater ID (keyset pagination)
+            summary: Skip loading `content` (accessing it then raises), for list views
+        """
+        async with self._session() as session:
             result = await session.execute(
-                select(Publication).offset(skip).limit(limit)
+                _paginate(
+                    _select_publications(summary),
+                    Publication.id,
+                    skip,
+                    limit,
+                    after_id,
+                )
             )
             return result.scalars().all()
 
+    @instrumented
     async def get_publications_by_owner(
-        self, owner_id: int, skip: int = 0, limit: int = 100
+        self,
+        owner_id: int,
+        skip: int = 0,
+        limit: int = 100,
+        after_id: int | None = None,
+        summary: bool = False,
     ) -> Sequence[Publication]:
-        """Get all publications owned by a specific user"""
-        async with self.async_session() as session:
+        """
+        Get all publications owned by a specific user
+        (paginated and summarized like get_all_publications)
+        """
+        async with self._session() as session:
             result = await session.execute(
-                select(Publication)
-                .where(Publication.owner_id == owner_id)
-                .offset(skip)
-                .limit(limit)
+                _paginate(
+                    _select_publications(summary).where(
+                        Publication.owner_id == owner_id
+                    ),
+                    Publication.id,
+                    skip,
+                    limit,
+                    after_id,
+                )
             )
             return result.scalars().all()
 
+    async def stream_publications(
+        self, batch_size: int = 1000
+    ) -> AsyncIterator[Sequence[Publication]]:
+        """Yield all publications in ID order, `batch_size` at a time (like stream_users)"""
+        async with self.read_session() as session:
+            result = await session.stream(
+                select(Publication)
+                .order_by(Publication.id)
+                .execution_options(yield_per=batch_size)
+            )
+            async for batch in result.scalars().partitions():
+                yield batch
+
+    @instrumented
+    async def search_publications(
+        self, query: str, limit: int = 20, cursor: str | None = None
+    ) -> tuple[Sequence[Publication], str | None]:
+        """
+        Full-text search in publication titles and content, best matches first
+        Args:
+            query: Words that must all appear in the publication
+            limit: Maximum number of publications to return
+            cursor: Opaque cursor returned with the previous page
+        Returns:
+            The matching publications and the cursor of the next page (None on the last page)
+        Raises:
+            ValueError: If the limit is not positive or the cursor is invalid
+        """
+        if limit < 1:
+            raise ValueError("limit must be positive")
+        offset = int(cursor) if cursor else 0
+        if offset < 0:
+            raise ValueError(f"invalid cursor: {cursor}")
+        match_query = _fts_match_query(query)
+        if not match_query:
+            return [], None
+
+        async with self._session() as session:
+            result = await session.execute(
+                select(Publication)
+                .select_from(publications_fts)
+                .join(Publication, Publication.id == publications_fts.c.rowid)
+                .where(text("publications_fts MATCH :query"))
+                .order_by(publications_fts.c.rank, Publication.id)
+                .limit(limit + 1)
+                .offset(offset),
+                {"query": match_query},
+            )
+            publications = result.scalars().all()
+
+        if len(publications) > limit:
+            return publications[:limit], str(offset + limit)
+        return publications, None
+
+    @instrumented
     async def update_publication(
-        self, publication_id: int, **kwargs
+        self, publication_id: int, expected_version: int | None = None, **kwargs
     ) -> Publication | None:
         """
-        Update publication fields
+        Update publication fields with a single UPDATE ... RETURNING statement
+        Every update increments the publication's `version`
         Args:
             publication_id: Publication ID to update
-            **kwargs: Fields to update (name, description, price, quantity)
+            expected_version: Update only if the publication is still at this
+                version, so concurrent editors can't overwrite each other
+            **kwargs: Fields to update (title, content); unknown fields are ignored
         Returns:
             Updated Publication object or None if not found
+        Raises:
+            VersionConflict: If the publication is at another version than expected
         """
-        async with self.async_session() as session:
-            result = await session.execute(
-                select(Publication).where(Publication.id == publication_id)
-            )
-            publication = result.scalar_one_or_none()
-
-            if publication:
-                for key, value in kwargs.items():
-                    if hasattr(publication, key):
-                        setattr(publication, key, value)
-                await session.commit()
-                await session.refresh(publication)
+        values = {
+            key: value
+            for key, value in kwargs.items()
+            if key in Publication.__table__.columns and key != "version"
+        }
+        if not values:
+            publication = await self.get_publication(publication_id)
+            if (
+                publication is not None
+                and expected_version is not None
+                and publication.version != expected_version
+            ):
+                raise VersionConflict(publication.version)
             return publication
+        if "content" in values:
+            values["content"] = self._encode_content(values["content"])
 
+        async with self._session(write=True) as session:
+            condition = Publication.id == publication_id
+            if expected_version is not None:
+                condition = and_(condition, Publication.version == expected_version)
+            publication = await session.scalar(
+                update(Publication)
+                .where(condition)
+                .values(**values, version=Publication.version + 1)
+                .returning(Publication)
+                # refresh a row already loaded in the unit of work from RETURNING
+                # (in-Python evaluation would set `content` to the encoded value)
+                .execution_options(populate_existing=True)
+            )
+            if publication is None and expected_version is not None:
+                current_version = await session.scalar(
+                    select(Publication.version).where(Publication.id == publication_id)
+                )
+                if current_version is not None:
+                    raise VersionConflict(current_version)
+            await self._commit(session)
+        if "owner_id" in values:
+            # the counts of both the old and the new owner changed
+            self._invalidate_cached_users()
+        return publication
+
+    @instrumented
     async def delete_publication(self, publication_id: int) -> bool:
         """
         Delete publication by ID
         Returns:
             True if deleted, False if not found
         """
-        async with self.async_session() as session:
+        async with self._session(write=True) as session:
+            owner_id = await session.scalar(
+                delete(Publication)
+                .where(Publication.id == publication_id)
+                .returning(Publication.owner_id)
+            )
+            await self._commit(session)
+        if owner_id is None:
+            return False
+        self._invalidate_cached_user(owner_id)
+        return True
+
+    @instrumented
+    async def delete_publications_by_owner(self, owner_id: int) -> int:
+        """
+        Delete all publications of a user with a single DELETE statement
+        Returns:
+            Number of deleted publications
+        """
+        async with self._session(write=True) as session:
             result = await session.execute(
-                delete(Publication).where(Publication.id == publication_id)
+                delete(Publication).where(Publication.owner_id == owner_id)
             )
-            await session.commit()
-            return result.rowcount > 0  # type: ignore
+            await self._commit(session)
+        self._invalidate_cached_user(owner_id)
+        return result.rowcount  # type: ignore
+
+    @instrumented
+    async def compress_publications(self, batch_size: int = 1000) -> int:
+        """
+        Migrate stored content to the configured `content_codec`
+        Compresses the existing long content after compression was enabled, or
+        decompresses everything when no codec is configured, and switches the
+        search triggers to match (see create_tables). Runs one transaction per
+        `batch_size` publications and keeps their `updated_at`
+        Returns:
+            Number of rewritten publications
+        """
+        if self.content_codec is not None:
+            pending = and_(
+                func.typeof(Publication.content) == "text",
+                func.length(cast(Publication.content, LargeBinary))
+                > self.content_codec.threshold,
+            )
+        else:
+            pending = func.typeof(Publication.content) == "blob"
+        publications = Publication.__table__
+        rewrite = (
+            update(publications)
+            .where(publications.c.id == bindparam("publication_id"))
+            .values(
+                content=bindparam("stored_content"),
+                updated_at=publications.c.updated_at,
+            )
+        )
+
+        if self.content_codec is not None:
+            # index the text of the content about to be compressed
+            async with self._session(write=True) as session:
+                await self._use_search_triggers(session)
+                await self._commit(session)
+        rewritten = 0
+        after_id = 0
+        while True:
+            async with self._session(write=True) as session:
+                rows = (
+                    await session.execute(
+                        select(Publication.id, Publication.content)
+                        .where(Publication.id > after_id, pending)
+                        .order_by(Publication.id)
+                        .limit(batch_size)
+                    )
+                ).all()
+                if not rows:
+                    if self.content_codec is None:
+                        # nothing is compressed anymore
+                        await self._use_search_triggers(session)
+                        await self._commit(session)
+                    return rewritten
+                after_id = rows[-1].id
+                changes = []
+                for row in rows:
+                    stored = self._encode_content(row.content)
+                    if self.content_codec is not None and isinstance(stored, str):
+                        continue  # compression doesn't pay off, the row stays text
+                    changes.append({"publication_id": row.id, "stored_content": stored})
+                if changes:
+                    await session.execute(rewrite, changes)
+                await self._commit(session)
+            rewritten += len(changes)
+
+    async def _use_search_triggers(self, session: AsyncSession):
+        """Switch the search triggers of a session's database (see create_tables)"""
+        conn = await session.connection()
+        await conn.run_sync(use_search_triggers, self.content_codec is not None)
@@ -3,13 +3,99 @@ SQLAlchemy ORM Models for Workshop 3
 Defines Publication and User models with relationships
 """
 
+import zlib
 from datetime import datetime, timezone
-from sqlalchemy import Column, Integer, String, Float, DateTime, ForeignKey, Boolean
+from sqlalchemy import (
+    Column,
+    Integer,
+    String,
+    Float,
+    DateTime,
+    ForeignKey,
+    Boolean,
+    Index,
+    text,
+)
 from sqlalchemy.orm import declarative_base, relationship
+from sqlalchemy.types import TypeDecorator
+
+try:
+    import zstandard
+except ImportError:  # optional, only needed for the "zstd" codec
+    zstandard = None
 
 Base = declarative_base()
 
 
+# first byte of a compressed value, the rest is the compressed UTF-8 text
+_ZLIB = b"\x01"
+_ZSTD = b"\x02"
+
+
+class ContentCodec:
+    """
+    Compression of publication content longer than `threshold` bytes
+    Compressed content is stored as a BLOB in the same column, short (or
+    incompressible) content stays TEXT, so both kinds of rows can coexist
+    """
+
+    def __init__(self, algorithm: str = "zlib", threshold: int = 1024, level=None):
+        """
+        Args:
+            algorithm: "zlib" or "zstd" (needs the `zstandard` package)
+            threshold: Content of at most this many UTF-8 bytes is stored as is
+            level: Compression level (default: the algorithm's default)
+        """
+        if algorithm not in ("zlib", "zstd"):
+            raise ValueError(f"Unknown compression algorithm: {algorithm}")
+        if algorithm == "zstd" and zstandard is None:
+            raise ImportError("The zstd codec needs the `zstandard` package")
+        self.algorithm = algorithm
+        self.threshold = threshold
+        self.level = level
+
+    def encode(self, content: str) -> str | bytes:
+        """Value to store for `content`"""
+        data = content.encode()
+        if len(data) <= self.threshold:
+            return content
+        if self.algorithm == "zlib":
+            compressed = _ZLIB + zlib.compress(
+                data, -1 if self.level is None else self.level
+            )
+        else:
+            compressed = _ZSTD + zstandard.ZstdCompressor(
+                level=3 if self.level is None else self.level
+            ).compress(data)
+        return compressed if len(compressed) < len(data) else content
+
+    @staticmethod
+    def decode(value: str | bytes | None) -> str | None:
+        """Content of a stored value, compressed by any codec or not at all"""
+        if not isinstance(value, bytes):
+            return value
+        if value[:1] == _ZLIB:
+            return zlib.decompress(value[1:]).decode()
+        if value[:1] == _ZSTD:
+            if zstandard is None:
+                raise ImportError("Reading zstd content needs the `zstandard` package")
+            return zstandard.ZstdDecompressor().decompress(value[1:]).decode()
+        raise ValueError("Unknown compressed content format")
+
+
+class CompressibleText(TypeDecorator):
+    """
+    Text column that may hold ContentCodec BLOBs, decoded when the row is loaded
+    Values are stored as given, DatabaseService encodes them with its codec
+    """
+
+    impl = String
+    cache_ok = True
+
+    def process_result_value(self, value, dialect):
+        return ContentCodec.decode(value)
+
+
 class User(Base):
     """User model for authentication and ownership tracking"""
 
@@ -17,13 +103,22 @@ class User(Base):
 
     id = Column(Integer, primary_key=True, autoincrement=True)
     username = Column(String(50), unique=True, nullable=False, index=True)
-    email = Column(String(100), unique=True, nullable=False)
+    email = Column(String(100), unique=True, nullable=False, index=True)
     password_hash = Column(String(255), nullable=False)
     is_admin = Column(Boolean, default=False, nullable=False)
     created_at = Column(DateTime, default=datetime.now(timezone.utc), nullable=False)
+    # kept exact by the triggers on `publications` from migrations.py
+    publication_count = Column(
+        Integer, default=0, server_default=text("0"), nullable=False
+    )
 
     publications = relationship(
-        "Publication", back_populates="owner", cascade="all, delete-orphan"
+        "Publication",
+        back_populates="owner",
+        cascade="all, delete-orphan",
+        # leave deleting the publications to ON DELETE CASCADE instead of
+        # loading them all into the session first
+        passive_deletes=True,
     )
 
 
@@ -31,10 +126,16 @@ class Publication(Base):
     """Publication model for inventory management"""
 
     __tablename__ = "publications"
+    # existing databases get new indexes through migrations.py
+    __table_args__ = (
+        # publications of an owner in id (= creation) order
+        Index("ix_publications_owner_id_id", "owner_id", "id"),
+        Index("ix_publications_created_at", "created_at"),
+    )
 
     id = Column(Integer, primary_key=True, autoincrement=True)
     title = Column(String(200), nullable=False, index=True)
-    content = Column(String, nullable=False)
+    content = Column(CompressibleText, nullable=False)
     owner_id = Column(
         Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False
     )
@@ -46,4 +147,7 @@ class Publication(Base):
         nullable=False,
     )
 
+    # bumped by every update_publication, for optimistic concurrency control
+    version = Column(Integer, default=1, server_default=text("1"), nullable=False)
+
     owner = relationship("User", back_populates="publications")
@@ -0,0 +1,1458 @@
+"""
+DatabaseService Tests
+Tests for database operations that are not covered through the API tests
+"""
+
+import asyncio
+import sqlite3
+import time
+import pytest
+from sqlalchemy import event, select, text
+from sqlalchemy.dialects import sqlite
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
+from cache import TTLCache
+from db import (
+    DatabaseService,
+    EmailTaken,
+    SQLiteProfile,
+    UsernameTaken,
+    VersionConflict,
+    _paginate,
+    etag_version,
+    publication_etag,
+    next_cursor,
+    sqlite_read_only_url,
+)
+from db_models import ContentCodec, Publication
+from loader import BatchLoader
+from write_queue import WriteBehindQueue
+from migrations import MIGRATIONS, get_schema_version, search_decodes_content
+from passwords import (
+    LegacySHA256Hasher,
+    PasswordHasher,
+    PBKDF2Hasher,
+    ScryptHasher,
+    verify_password,
+)
+
+# =========
+# FIXTURES
+# =========
+
+
+@pytest.fixture
+async def test_db():
+    """Create an in-memory database for testing"""
+    # a low work factor keeps password hashing from dominating the test run
+    db = DatabaseService(
+        "sqlite+aiosqlite:///:memory:", password_hasher=PBKDF2Hasher(iterations=1000)
+    )
+    await db.create_tables()
+    yield db
+    await db.close()
+
+
+@pytest.fixture
+async def cached_db():
+    """Create an in-memory database with the user and credential caches enabled"""
+    db = DatabaseService(
+        "sqlite+aiosqlite:///:memory:",
+        user_cache_size=100,
+        credential_cache_size=100,
+        password_hasher=PBKDF2Hasher(iterations=1000),
+    )
+    await db.create_tables()
+    yield db
+    await db.close()
+
+
+@pytest.fixture
+async def sample_user(test_db):
+    """Create a sample non-admin user for testing"""
+    user = await test_db.create_user(
+        username="testuser", email="test@example.com", password="password123"
+    )
+    return user
+
+
+# ==================== BULK INSERT TESTS ====================
+
+
+@pytest.mark.asyncio
+async def test_create_users_bulk(test_db):
+    """Test that bulk-created users get ids in input order and can log in"""
+    users = [
+        {"username": f"user{i}", "email": f"user{i}@example.com", "password": "pass123"}
+        for i in range(25)
+    ]
+
+    user_ids = await test_db.create_users_bulk(users, batch_size=10)
+
+    assert len(user_ids) == 25
+    for user_id, record in zip(user_ids, users):
+        user = await test_db.get_user(user_id)
+        assert user.username == record["username"]
+        assert user.is_admin == False
+    assert await test_db.authenticate_user("user7", "pass123") is not None
+
+
+@pytest.mark.asyncio
+async def test_create_publications_bulk(test_db, sample_user):
+    """Test that bulk-created publications get ids in input order"""
+    publications = (
+        {"title": f"Title {i}", "content": f"Content {i}", "owner_id": sample_user.id}
+        for i in range(15)
+    )
+
+    publication_ids = await test_db.create_publications_bulk(publications, batch_size=4)
+
+    assert len(publication_ids) == 15
+    publication = await test_db.get_publication(publication_ids[3])
+    assert publication.title == "Title 3"
+    owned = await test_db.get_publications_by_owner(sample_user.id)
+    assert len(owned) == 15
+
+
+@pytest.mark.asyncio
+async def test_bulk_insert_statements_per_batch(test_db, sample_user):
+    """Test that each batch is one multi-row INSERT ... RETURNING, not one per row"""
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        if statement.startswith("INSERT"):
+            statements.append(statement)
+
+    event.listen(test_db.engine.sync_engine, "before_cursor_execute", record)
+    publication_ids = await test_db.create_publications_bulk(
+        (
+            {"title": f"Title {i}", "content": "Content", "owner_id": sample_user.id}
+            for i in range(300)
+        ),
+        batch_size=100,
+    )
+    event.remove(test_db.engine.sync_engine, "before_cursor_execute", record)
+
+    assert len(statements) == 3
+    assert all("RETURNING" in statement for statement in statements)
+    assert publication_ids == sorted(publication_ids)
+    publication = await test_db.get_publication(publication_ids[150])
+    assert publication.title == "Title 150"
+
+
+@pytest.mark.asyncio
+async def test_create_users_bulk_hashes_before_writing(test_db):
+    """Test that no password is hashed once the bulk insert holds the write lock"""
+    events = []
+
+    class RecordingHasher(PBKDF2Hasher):
+        def hash(self, password: str) -> str:
+            events.append("hash")
+            return super().hash(password)
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        if statement.startswith("INSERT"):
+            events.append("insert")
+
+    test_db.password_hasher = RecordingHasher(iterations=1000)
+    event.listen(test_db.engine.sync_engine, "before_cursor_execute", record)
+    await test_db.create_users_bulk(
+        (
+            {"username": f"user{i}", "email": f"user{i}@example.com", "password": "x"}
+            for i in range(6)
+        ),
+        batch_size=2,
+    )
+    event.remove(test_db.engine.sync_engine, "before_cursor_execute", record)
+
+    assert events == ["hash"] * 6 + ["insert"] * 3
+
+
+@pytest.mark.asyncio
+async def test_create_users_bulk_empty(test_db):
+    """Test that bulk insert of no records is a no-op"""
+    assert await test_db.create_users_bulk([]) == []
+
+
+@pytest.mark.asyncio
+async def test_create_users_bulk_invalid_batch_size(test_db):
+    """Test that a non-positive batch size is rejected"""
+    with pytest.raises(ValueError):
+        await test_db.create_users_bulk([], batch_size=0)
+
+
+# ==================== PAGINATION TESTS ====================
+
+
+@pytest.mark.asyncio
+async def test_keyset_pagination_matches_offset(test_db, sample_user):
+    """Test that walking pages by cursor returns the same rows as offsets"""
+    await test_db.create_publications_bulk(
+        {"title": f"Title {i}", "content": "Content", "owner_id": sample_user.id}
+        for i in range(10)
+    )
+
+    by_cursor = []
+    after_id = None
+    while True:
+        page = await test_db.get_all_publications(limit=3, after_id=after_id)
+        by_cursor.extend(page)
+        after_id = next_cursor(page, 3)
+        if after_id is None:
+            break
+
+    by_offset = await test_db.get_all_publications(skip=0, limit=100)
+    assert [p.id for p in by_cursor] == [p.id for p in by_offset]
+    assert next_cursor([], 0) is None
+
+
+# ==================== USER CACHE TESTS ====================
+
+
+def test_ttl_cache_expiry_and_lru_eviction():
+    """Test that entries expire after the TTL and the oldest entry is evicted"""
+    now = [0.0]
+    cache = TTLCache(maxsize=2, ttl=10, clock=lambda: now[0])
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+    cache.set("c", 3)  # evicts "b", the least recently used
+
+    assert cache.get("b") is None
+    now[0] = 11
+    assert cache.get("a") is None
+    assert cache.stats() == {"hits": 1, "misses": 2, "size": 1, "maxsize": 2}
+
+
+def test_ttl_cache_pop_tag():
+    """Test that pop_tag removes the entries of one tag and forgets evicted ones"""
+    cache = TTLCache(maxsize=3, ttl=10)
+    cache.set("a", 1, tag="x")
+    cache.set("b", 2, tag="x")
+    cache.set("c", 3, tag="y")
+    cache.set("d", 4)  # evicts "a"
+
+    assert cache.pop_tag("x") == 1
+    assert cache.get("b") is None
+    assert cache.get("c") == 3
+    assert cache.pop_tag("x") == 0
+
+
+@pytest.mark.asyncio
+async def test_user_cache_hits_by_every_key(cached_db):
+    """Test that a loaded user is served from the cache by id, username and email"""
+    user = await cached_db.create_user("cacheduser", "cached@example.com", "pass123")
+    before = cached_db.user_cache.stats()
+
+    await cached_db.get_user(user.id)
+    assert await cached_db.get_user_by_username("cacheduser") is not None
+    assert await cached_db.get_user_by_email("cached@example.com") is not None
+
+    stats = cached_db.user_cache.stats()
+    assert stats["hits"] - before["hits"] == 2
+    assert stats["misses"] - before["misses"] == 1
+
+
+@pytest.mark.asyncio
+async def test_user_cache_invalidated_on_update(cached_db):
+    """Test that an update evicts every key of the old user"""
+    user = await cached_db.create_user("cacheduser", "cached@example.com", "pass123")
+    await cached_db.get_user(user.id)
+
+    await cached_db.update_user(user.id, username="renamed")
+
+    assert await cached_db.get_user_by_username("cacheduser") is None
+    assert (await cached_db.get_user(user.id)).username == "renamed"
+
+
+@pytest.mark.asyncio
+async def test_user_cache_invalidated_on_delete(cached_db):
+    """Test that a deleted user is no longer served from the cache"""
+    user = await cached_db.create_user("cacheduser", "cached@example.com", "pass123")
+    await cached_db.get_user_by_email("cached@example.com")
+
+    await cached_db.delete_user(user.id)
+
+    assert await cached_db.get_user(user.id) is None
+    assert await cached_db.get_user_by_email("cached@example.com") is None
+
+
+@pytest.mark.asyncio
+async def test_user_cache_invalidation_is_per_user(cached_db):
+    """Test that invalidating one user keeps the others cached, even mid-lookup"""
+    user = await cached_db.create_user("cacheduser", "cached@example.com", "pass123")
+    other = await cached_db.create_user("other", "other@example.com", "pass123")
+    await cached_db.get_user(user.id)
+
+    # a lookup of `other` that started before the publication was created
+    generation = cached_db._user_cache_generation
+    await cached_db.create_publication("Title", "Content", user.id)
+    cached_db._cache_user(other, generation)
+
+    assert cached_db.user_cache.get(("id", user.id)) is None
+    assert cached_db.user_cache.get(("id", other.id)) is other
+    cached_db._cache_user(user, generation)
+    assert cached_db.user_cache.get(("id", user.id)) is None
+
+
+@pytest.mark.asyncio
+async def test_credential_cache_skips_database(cached_db):
+    """Test that a repeated login is answered from the credential cache"""
+    await cached_db.create_user("cacheduser", "cached@example.com", "pass123")
+
+    first = await cached_db.authenticate_user("cacheduser", "pass123")
+    statements = cached_db.metrics.snapshot()["authenticate_user"]["statements"]
+    second = await cached_db.authenticate_user("cacheduser", "pass123")
+
+    assert second is first
+    assert cached_db.credential_cache.stats()["hits"] == 1
+    snapshot = cached_db.metrics.snapshot()
+    assert snapshot["authenticate_user"]["statements"] == statements
+    assert await cached_db.authenticate_user("cacheduser", "wrong") is None
+
+
+def test_credential_cache_needs_user_cache():
+    """Test that a credential cache without a user cache is refused"""
+    with pytest.raises(ValueError):
+        DatabaseService("sqlite+aiosqlite:///:memory:", credential_cache_size=10)
+
+
+@pytest.mark.asyncio
+async def test_credential_cache_evicted_on_password_change(cached_db):
+    """Test that the old password stops working right after a password change"""
+    user = await cached_db.create_user("cacheduser", "cached@example.com", "pass123")
+    await cached_db.authenticate_user("cacheduser", "pass123")
+
+    await cached_db.update_user(user.id, password="newpass123")
+
+    assert await cached_db.authenticate_user("cacheduser", "pass123") is None
+    assert await cached_db.authenticate_user("cacheduser", "newpass123") is not None
+
+
+@pytest.mark.asyncio
+async def test_credential_cache_evicted_on_delete(cached_db):
+    """Test that a deleted user can no longer log in from the cache"""
+    user = await cached_db.create_user("cacheduser", "cached@example.com", "pass123")
+    await cached_db.authenticate_user("cacheduser", "pass123")
+
+    await cached_db.delete_user(user.id)
+
+    assert await cached_db.authenticate_user("cacheduser", "pass123") is None
+
+
+# ==================== PASSWORD HASHING TESTS ====================
+
+
+@pytest.mark.parametrize(
+    "hasher",
+    [PBKDF2Hasher(iterations=1000), ScryptHasher(n=2**10), LegacySHA256Hasher()],
+)
+def test_password_hashers_roundtrip(hasher):
+    """Test that every hasher verifies its own hashes and rejects wrong passwords"""
+    encoded = hasher.hash("secret123")
+
+    assert verify_password("secret123", encoded)
+    assert not verify_password("wrong", encoded)
+    assert not hasher.needs_rehash(encoded)
+
+
+def test_needs_rehash_after_raising_work_factor():
+    """Test that hashes made with fewer iterations are flagged for an upgrade"""
+    encoded = PBKDF2Hasher(iterations=1000).hash("secret123")
+
+    assert PBKDF2Hasher(iterations=2000).needs_rehash(encoded)
+    assert ScryptHasher().needs_rehash(encoded)
+
+
+def test_incomplete_hasher_cannot_be_created():
+    """Test that a hasher missing one of the methods fails on construction"""
+
+    class HashOnly(PasswordHasher):
+        def hash(self, password: str) -> str:
+            return password
+
+    with pytest.raises(TypeError):
+        HashOnly()
+
+
+@pytest.mark.asyncio
+async def test_legacy_hash_upgraded_on_login(test_db, sample_user):
+    """Test that a legacy sha256 hash still logs in and is replaced by the new format"""
+    legacy_hash = LegacySHA256Hasher().hash("password123")
+    await test_db.update_user(sample_user.id, password_hash=legacy_hash)
+
+    user = await test_db.authenticate_user("testuser", "password123")
+
+    assert user is not None
+    assert user.password_hash.startswith("pbkdf2_sha256$1000$")
+    stored = await test_db.get_user(sample_user.id)
+    assert stored.password_hash == user.password_hash
+    assert await test_db.authenticate_user("testuser", "password123") is not None
+
+
+@pytest.mark.asyncio
+async def test_unknown_username_costs_a_password_check(test_db, monkeypatch):
+    """Test that logins of unknown users derive a key like those of existing ones"""
+    verified = []
+    monkeypatch.setattr(
+        "db.verify_password", lambda password, encoded: verified.append(encoded)
+    )
+
+    assert await test_db.authenticate_user("nobody", "password123") is None
+    assert await test_db.authenticate_user("nobody", "password123") is None
+
+    assert len(verified) == 2
+    assert verified[0].startswith("pbkdf2_sha256$1000$")
+    assert verified[0] == verified[1]
+
+
+# ==================== SQLITE PROFILE TESTS ====================
+
+
+@pytest.mark.asyncio
+async def test_sqlite_profile_applied_to_connections(tmp_path):
+    """Test that the profile PRAGMAs are set on new connections"""
+    db = DatabaseService(
+        f"sqlite+aiosqlite:///{tmp_path / 'profile.db'}",
+        sqlite_profile=SQLiteProfile(busy_timeout=1234),
+    )
+    async with db.engine.connect() as conn:
+        journal_mode = await conn.scalar(text("PRAGMA journal_mode"))
+        synchronous = await conn.scalar(text("PRAGMA synchronous"))
+        busy_timeout = await conn.scalar(text("PRAGMA busy_timeout"))
+    await db.close()
+
+    assert journal_mode == "wal"
+    assert synchronous == 1  # NORMAL
+    assert busy_timeout == 1234
+
+
+# ==================== READ ENGINE TESTS ====================
+
+
+def test_sqlite_read_only_url():
+    """Test that a file URL is turned into a read-only SQLite URI"""
+    assert (
+        sqlite_read_only_url("sqlite+aiosqlite:///./workshop.db")
+        == "sqlite+aiosqlite:///file:./workshop.db?mode=ro&uri=true"
+    )
+
+
+@pytest.mark.asyncio
+async def test_reads_use_read_only_engine(tmp_path):
+    """Test that get_* queries go through the read-only engine and see committed writes"""
+    database_url = f"sqlite+aiosqlite:///{tmp_path / 'split.db'}"
+    db = DatabaseService(
+        database_url,
+        password_hasher=PBKDF2Hasher(iterations=1000),
+        sqlite_profile=SQLiteProfile(),
+        read_database_url=sqlite_read_only_url(database_url),
+    )
+    await db.create_tables()
+    user = await db.create_user("splituser", "split@example.com", "pass123")
+
+    assert db.read_engine is not db.engine
+    assert (await db.get_user(user.id)).username == "splituser"
+    assert await db.authenticate_user("splituser", "pass123") is not None
+    async with db.read_engine.connect() as conn:
+        with pytest.raises(Exception, match="readonly"):
+            await conn.execute(text("DELETE FROM users"))
+    await db.close()
+
+
+# ==================== INDEX AND MIGRATION TESTS ====================
+
+
+async def explain_query_plan(db, statement) -> str:
+    """EXPLAIN QUERY PLAN output of a statement as one string"""
+    sql = statement.compile(
+        dialect=sqlite.dialect(), compile_kwargs={"literal_binds": True}
+    )
+    async with db.engine.connect() as conn:
+        rows = await conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {sql}")
+        return "\n".join(row.detail for row in rows)
+
+
+@pytest.mark.asyncio
+async def test_publications_by_owner_uses_index(test_db):
+    """Test that per-owner listing is an index range scan without a sort step"""
+    statement = _paginate(
+        select(Publication).where(Publication.owner_id == 1),
+        Publication.id,
+        skip=0,
+        limit=10,
+        after_id=5,
+    )
+
+    plan = await explain_query_plan(test_db, statement)
+
+    assert "ix_publications_owner_id_id" in plan
+    assert "TEMP B-TREE" not in plan
+
+
+@pytest.mark.asyncio
+async def test_publications_by_created_at_uses_index(test_db):
+    """Test that ordering by creation time is served by its index"""
+    statement = select(Publication).order_by(Publication.created_at.desc()).limit(10)
+
+    plan = await explain_query_plan(test_db, statement)
+
+    assert "ix_publications_created_at" in plan
+
+
+@pytest.mark.asyncio
+async def test_migrations_upgrade_existing_database(test_db):
+    """Test that an old database without the new indexes is upgraded by create_tables"""
+    async with test_db.engine.begin() as conn:
+        await conn.exec_driver_sql("DROP INDEX ix_publications_owner_id_id")
+        await conn.exec_driver_sql("DROP INDEX ix_publications_created_at")
+        await conn.exec_driver_sql("PRAGMA user_version = 0")
+
+    await test_db.create_tables()
+
+    async with test_db.engine.connect() as conn:
+        assert await conn.run_sync(get_schema_version) == MIGRATIONS[-1][0]
+        indexes = await conn.exec_driver_sql(
+            "SELECT name FROM sqlite_master WHERE type = 'index'"
+        )
+        index_names = {row.name for row in indexes}
+    assert {"ix_publications_owner_id_id", "ix_publications_created_at"} <= index_names
+
+
+# ==================== SINGLE-STATEMENT WRITE TESTS ====================
+
+
+@pytest.mark.asyncio
+async def test_update_publication_returns_updated_row(test_db, sample_user):
+    """Test that an update returns the new values and ignores unknown fields"""
+    publication = await test_db.create_publication("Title", "Content", sample_user.id)
+
+    updated = await test_db.update_publication(
+        publication.id, title="New title", not_a_column="ignored"
+    )
+
+    assert updated.id == publication.id
+    assert updated.title == "New title"
+    assert updated.content == "Content"
+    assert (await test_db.get_publication(publication.id)).title == "New title"
+
+
+@pytest.mark.asyncio
+async def test_update_missing_rows_returns_none(test_db):
+    """Test that updates of rows that don't exist return None"""
+    assert await test_db.update_user(9999, email="nobody@example.com") is None
+    assert await test_db.update_publication(9999, title="Nothing") is None
+
+
+@pytest.mark.asyncio
+async def test_create_publication_returns_defaults(test_db, sample_user):
+    """Test that server-filled columns are returned without a refresh"""
+    publication = await test_db.create_publication("Title", "Content", sample_user.id)
+
+    assert publication.id is not None
+    assert publication.created_at is not None
+    assert publication.updated_at is not None
+
+
+@pytest.mark.asyncio
+async def test_writes_are_single_statements(test_db, sample_user):
+    """Test that create and update each execute exactly one SQL statement"""
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(test_db.engine.sync_engine, "before_cursor_execute", record)
+    publication = await test_db.create_publication("Title", "Content", sample_user.id)
+    await test_db.update_publication(publication.id, title="New title")
+    event.remove(test_db.engine.sync_engine, "before_cursor_execute", record)
+
+    assert len(statements) == 2
+    assert statements[0].startswith("INSERT") and "RETURNING" in statements[0]
+    assert statements[1].startswith("UPDATE") and "RETURNING" in statements[1]
+
+
+# ==================== REGISTRATION TESTS ====================
+
+
+@pytest.mark.asyncio
+async def test_register_user_taken_fields(test_db, sample_user):
+    """Test that duplicates are reported with typed errors"""
+    with pytest.raises(UsernameTaken):
+        await test_db.register_user("testuser", "other@example.com", "pass123")
+    with pytest.raises(EmailTaken):
+        await test_db.register_user("otheruser", "test@example.com", "pass123")
+
+
+@pytest.mark.asyncio
+async def test_concurrent_registrations_single_winner(tmp_path):
+    """Test that only one of many concurrent signups for one username succeeds"""
+    db = DatabaseService(
+        f"sqlite+aiosqlite:///{tmp_path / 'signup.db'}",
+        password_hasher=PBKDF2Hasher(iterations=1000),
+        sqlite_profile=SQLiteProfile(),
+    )
+    await db.create_tables()
+
+    results = await asyncio.gather(
+        *(
+            db.register_user("racer", f"racer{i}@example.com", "pass123")
+            for i in range(10)
+        ),
+        return_exceptions=True,
+    )
+    await db.close()
+
+    assert sum(not isinstance(result, Exception) for result in results) == 1
+    assert all(
+        isinstance(result, UsernameTaken)
+        for result in results
+        if isinstance(result, Exception)
+    )
+
+
+# ==================== FULL-TEXT SEARCH TESTS ====================
+
+
+@pytest.fixture
+async def searchable_publications(test_db, sample_user):
+    """Publications with known words in their titles and content"""
+    records = [
+        ("Async Python", "Coroutines and the event loop"),
+        ("SQLite tips", "Use WAL mode with Python for concurrent readers"),
+        ("Cooking", "Bake the bread for forty minutes"),
+    ]
+    for title, content in records:
+        await test_db.create_publication(title, content, sample_user.id)
+
+
+@pytest.mark.asyncio
+async def test_search_publications_ranks_title_matches_first(
+    test_db, searchable_publications
+):
+    """Test that a title match ranks above a content match"""
+    publications, cursor = await test_db.search_publications("python")
+
+    assert [p.title for p in publications] == ["Async Python", "SQLite tips"]
+    assert cursor is None
+
+
+@pytest.mark.asyncio
+async def test_search_publications_follows_updates_and_deletes(
+    test_db, searchable_publications
+):
+    """Test that the triggers keep the index in sync with the table"""
+    [cooking], _ = await test_db.search_publications("bread")
+    await test_db.update_publication(cooking.id, content="Boil the pasta")
+
+    assert (await test_db.search_publications("bread"))[0] == []
+    assert len((await test_db.search_publications("pasta"))[0]) == 1
+
+    await test_db.delete_publication(cooking.id)
+    assert (await test_db.search_publications("pasta"))[0] == []
+
+
+@pytest.mark.asyncio
+async def test_search_publications_cursor(test_db, searchable_publications):
+    """Test paging through search results"""
+    first_page, cursor = await test_db.search_publications("python", limit=1)
+    second_page, last_cursor = await test_db.search_publications(
+        "python", limit=1, cursor=cursor
+    )
+
+    assert [p.title for p in first_page + second_page] == [
+        "Async Python",
+        "SQLite tips",
+    ]
+    assert last_cursor is None
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    "limit, cursor", [(0, None), (-5, None), (1, "-3"), (1, "page2")]
+)
+async def test_search_publications_invalid_page(
+    test_db, searchable_publications, limit, cursor
+):
+    """Test that a non-positive limit or a negative or malformed cursor is rejected"""
+    with pytest.raises(ValueError):
+        await test_db.search_publications("python", limit=limit, cursor=cursor)
+
+
+@pytest.mark.asyncio
+async def test_search_publications_ignores_query_syntax(
+    test_db, searchable_publications
+):
+    """Test that FTS5 operators in user input don't cause errors"""
+    publications, _ = await test_db.search_publications('"wal" -mode* (')
+
+    assert [p.title for p in publications] == ["SQLite tips"]
+    assert await test_db.search_publications("!!!") == ([], None)
+
+
+@pytest.mark.asyncio
+async def test_search_index_built_for_existing_publications(test_db, sample_user):
+    """Test that migrating an old database indexes the publications it already has"""
+    await test_db.create_publication("Legacy", "Written before search", sample_user.id)
+    async with test_db.engine.begin() as conn:
+        await conn.exec_driver_sql("DROP TABLE publications_fts")
+        await conn.exec_driver_sql("PRAGMA user_version = 1")
+
+    await test_db.create_tables()
+
+    publications, _ = await test_db.search_publications("legacy")
+    assert len(publications) == 1
+
+
+# ==================== STREAMING TESTS ====================
+
+
+@pytest.mark.asyncio
+async def test_stream_publications_in_batches(test_db, sample_user):
+    """Test that streaming yields every row once, in fixed-size batches"""
+    publication_ids = await test_db.create_publications_bulk(
+        {"title": f"Title {i}", "content": "Content", "owner_id": sample_user.id}
+        for i in range(25)
+    )
+
+    batches = [batch async for batch in test_db.stream_publications(batch_size=10)]
+
+    assert [len(batch) for batch in batches] == [10, 10, 5]
+    assert [p.id for batch in batches for p in batch] == publication_ids
+
+
+@pytest.mark.asyncio
+async def test_stream_users(test_db, sample_user):
+    """Test streaming all users"""
+    usernames = [
+        user.username async for batch in test_db.stream_users() for user in batch
+    ]
+
+    assert usernames == ["test_admin", "testuser"]
+
+
+# ==================== METRICS TESTS ====================
+
+
+@pytest.mark.asyncio
+async def test_metrics_per_method(test_db, sample_user):
+    """Test that calls, rows, statements and errors are recorded per method"""
+    await test_db.create_publications_bulk(
+        {"title": f"Title {i}", "content": "Content", "owner_id": sample_user.id}
+        for i in range(3)
+    )
+    await test_db.get_all_publications()
+    await test_db.get_publication(9999)
+    with pytest.raises(UsernameTaken):
+        await test_db.register_user("testuser", "other@example.com", "pass123")
+
+    snapshot = test_db.metrics.snapshot()
+    assert snapshot["get_all_publications"]["calls"] == 1
+    assert snapshot["get_all_publications"]["rows"] == 3
+    assert snapshot["get_all_publications"]["statements"] == 1
+    assert snapshot["get_publication"]["rows"] == 0
+    assert snapshot["register_user"]["errors"] == 1
+    # statements of the nested create_user call count for register_user too
+    assert snapshot["register_user"]["statements"] == 1
+
+
+@pytest.mark.asyncio
+async def test_metrics_concurrent_calls_counted_separately(test_db, sample_user):
+    """Test that statements of concurrent calls aren't attributed to each other"""
+    await asyncio.gather(*(test_db.get_all_users() for _ in range(10)))
+
+    assert test_db.metrics.snapshot()["get_all_users"]["statements"] == 10
+
+
+@pytest.mark.asyncio
+async def test_render_metrics_prometheus_format(cached_db):
+    """Test the Prometheus text output"""
+    await cached_db.get_user(1)
+    await cached_db.get_user(1)
+
+    text_output = cached_db.render_metrics()
+
+    assert 'db_method_duration_seconds_bucket{method="get_user",le="+Inf"} 2' in (
+        text_output
+    )
+    assert 'db_method_calls_total{method="get_user"} 2' in text_output
+    assert 'db_cache_hits_total{cache="user"}' in text_output
+
+
+# ==================== PUBLICATION COUNT TESTS ====================
+
+
+@pytest.mark.asyncio
+async def test_publication_count_follows_writes(test_db, sample_user):
+    """Test that the trigger-maintained count follows inserts, deletes and moves"""
+    other = await test_db.create_user("other", "other@example.com", "password")
+    first = await test_db.create_publication("First", "Content", sample_user.id)
+    await test_db.create_publications_bulk(
+        {"title": f"Bulk {i}", "content": "Content", "owner_id": sample_user.id}
+        for i in range(3)
+    )
+    assert await test_db.count_publications(sample_user.id) == 4
+
+    await test_db.delete_publication(first.id)
+    assert await test_db.count_publications(sample_user.id) == 3
+
+    publications = await test_db.get_publications_by_owner(sample_user.id)
+    await test_db.update_publication(publications[0].id, owner_id=other.id)
+    assert await test_db.count_publications(sample_user.id) == 2
+    assert await test_db.count_publications(other.id) == 1
+    assert await test_db.count_publications() == 3
+    assert await test_db.count_publications(9999) == 0
+
+
+@pytest.mark.asyncio
+async def test_cached_user_publication_count_refreshed(cached_db):
+    """Test that creating a publication evicts the owner's cached row"""
+    user = await cached_db.get_user_by_username("test_admin")
+    assert user.publication_count == 0
+
+    await cached_db.create_publication("Title", "Content", user.id)
+
+    assert (await cached_db.get_user(user.id)).publication_count == 1
+    assert (
+        await cached_db.authenticate_user("test_admin", "testing123")
+    ).publication_count == 1
+
+
+@pytest.mark.asyncio
+async def test_publication_count_backfilled_by_migration(test_db, sample_user):
+    """Test that migrating an old database counts the publications it already has"""
+    await test_db.create_publication("Legacy", "Content", sample_user.id)
+    async with test_db.engine.begin() as conn:
+        for trigger in ("insert", "delete", "update"):
+            await conn.exec_driver_sql(
+                f"DROP TRIGGER users_publication_count_{trigger}"
+            )
+        await conn.exec_driver_sql("UPDATE users SET publication_count = 0")
+        await conn.exec_driver_sql("PRAGMA user_version = 2")
+
+    await test_db.create_tables()
+
+    assert await test_db.count_publications(sample_user.id) == 1
+    await test_db.create_publication("New", "Content", sample_user.id)
+    assert await test_db.count_publications(sample_user.id) == 2
+
+
+# ==================== BATCH LOADING TESTS ====================
+
+
+@pytest.mark.asyncio
+async def test_concurrent_get_user_single_query(test_db):
+    """Test that concurrent lookups are merged into one de-duplicated query"""
+    user_ids = await test_db.create_users_bulk(
+        {"username": f"user{i}", "email": f"user{i}@example.com", "password": "pw"}
+        for i in range(5)
+    )
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(parameters)
+
+    event.listen(test_db.read_engine.sync_engine, "before_cursor_execute", record)
+    users = await asyncio.gather(
+        *(test_db.get_user(user_ids[i % 5]) for i in range(50)),
+        test_db.get_user(9999),
+    )
+    event.remove(test_db.read_engine.sync_engine, "before_cursor_execute", record)
+
+    assert [user.id for user in users[:50]] == [user_ids[i % 5] for i in range(50)]
+    assert users[50] is None
+    assert len(statements) == 1
+    assert sorted(statements[0]) == sorted(user_ids + [9999])
+
+
+@pytest.mark.asyncio
+async def test_concurrent_get_user_by_username_batched(test_db, sample_user):
+    """Test username lookups are batched separately from ID lookups"""
+    by_id, by_name, missing = await asyncio.gather(
+        test_db.get_user(sample_user.id),
+        test_db.get_user_by_username("testuser"),
+        test_db.get_user_by_username("nobody"),
+    )
+
+    assert by_id.id == by_name.id == sample_user.id
+    assert missing is None
+    assert test_db.user_loaders["username"].stats()["batches"] == 2  # + preload
+
+
+@pytest.mark.asyncio
+async def test_batch_loader_splits_and_propagates_errors():
+    """Test max_batch_size and that a failed batch fails each of its callers"""
+    batches = []
+
+    async def load_batch(keys):
+        batches.append(keys)
+        if "bad" in keys:
+            raise RuntimeError("boom")
+        return {key: key * 2 for key in keys}
+
+    loader = BatchLoader(load_batch, max_batch_size=2)
+    results = await asyncio.gather(*(loader.load(key) for key in [1, 2, 3, 1]))
+    assert results == [2, 4, 6, 2]
+    assert batches == [[1, 2], [3, 1]]
+
+    with pytest.raises(RuntimeError):
+        await asyncio.gather(loader.load("bad"), loader.load("x"))
+
+
+# ==================== UNIT OF WORK TESTS ====================
+
+
+@pytest.mark.asyncio
+async def test_unit_of_work_commits_on_one_connection(test_db, sample_user):
+    """Test that the writes in a unit of work and the reads after them share one connection"""
+    checkouts = []
+    record = lambda *args: checkouts.append(args)  # noqa: E731
+    async with test_db.unit_of_work():
+        user = await test_db.authenticate_user("testuser", "password123")
+        event.listen(test_db.engine.sync_engine, "checkout", record)
+        await test_db.update_user(user.id, email="new@example.com")
+        publication = await test_db.create_publication("Title", "Text", user.id)
+        # reads see the block's own writes
+        assert (await test_db.get_user(user.id)).email == "new@example.com"
+    event.remove(test_db.engine.sync_engine, "checkout", record)
+
+    assert len(checkouts) == 1
+    assert await test_db.get_publication(publication.id) is not None
+    assert (await test_db.get_user(user.id)).email == "new@example.com"
+
+
+@pytest.mark.asyncio
+async def test_unit_of_work_reads_use_read_engine_until_first_write(tmp_path):
+    """Test that requests in units of work keep the read engine and batched lookups"""
+    database_url = f"sqlite+aiosqlite:///{tmp_path / 'split.db'}"
+    db = DatabaseService(
+        database_url,
+        password_hasher=PBKDF2Hasher(iterations=1000),
+        sqlite_profile=SQLiteProfile(),
+        read_database_url=sqlite_read_only_url(database_url),
+    )
+    await db.create_tables()
+    user = await db.create_user("splituser", "split@example.com", "pass123")
+    statements = {"primary": 0, "read": 0}
+
+    def recorder(engine: str):
+        def record(*args):
+            statements[engine] += 1
+
+        return record
+
+    event.listen(db.engine.sync_engine, "before_cursor_execute", recorder("primary"))
+    event.listen(db.read_engine.sync_engine, "before_cursor_execute", recorder("read"))
+
+    async def request():
+        async with db.unit_of_work():
+            return await db.get_user(user.id)
+
+    users = await asyncio.gather(*(request() for _ in range(10)))
+    assert {found.username for found in users} == {"splituser"}
+    assert statements == {"primary": 0, "read": 1}
+
+    async with db.unit_of_work():
+        await db.get_all_publications()
+        await db.update_user(user.id, email="new@example.com")
+        # after a write, reads see the block's own uncommitted changes
+        assert (await db.get_user(user.id)).email == "new@example.com"
+    assert statements == {"primary": 2, "read": 2}
+    await db.close()
+
+
+@pytest.mark.asyncio
+async def test_unit_of_work_rolls_back_on_error(cached_db):
+    """Test that an exception discards every write and caches nothing uncommitted"""
+    admin = await cached_db.get_user_by_username("test_admin")
+
+    with pytest.raises(RuntimeError):
+        async with cached_db.unit_of_work():
+            user = await cached_db.create_user("temp", "temp@example.com", "pw")
+            await cached_db.update_user(admin.id, email="changed@example.com")
+            async with cached_db.unit_of_work():  # nested blocks join
+                await cached_db.create_publication("Title", "Text", admin.id)
+            assert (await cached_db.get_user(user.id)).username == "temp"
+            raise RuntimeError("handler failed")
+
+    assert await cached_db.get_user(user.id) is None
+    admin = await cached_db.get_user(admin.id)
+    assert admin.email == "test_admin@example.com"
+    assert admin.publication_count == 0
+    assert await cached_db.count_publications() == 0
+
+
+# ==================== CASCADING DELETE TESTS ====================
+
+
+@pytest.mark.asyncio
+async def test_delete_user_cascades_in_one_statement(test_db, sample_user):
+    """Test that the database deletes the user's publications with a single DELETE"""
+    await test_db.create_publications_bulk(
+        {"title": "Cascade", "content": "Content", "owner_id": sample_user.id}
+        for _ in range(1000)
+    )
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(test_db.engine.sync_engine, "before_cursor_execute", record)
+    assert await test_db.delete_user(sample_user.id)
+    event.remove(test_db.engine.sync_engine, "before_cursor_execute", record)
+
+    assert len(statements) == 1
+    assert await test_db.get_publications_by_owner(sample_user.id) == []
+    assert await test_db.search_publications("cascade") == ([], None)
+    assert await test_db.count_publications() == 0
+
+
+@pytest.mark.asyncio
+async def test_foreign_keys_enforced(test_db):
+    """Test that publications can't reference a missing user"""
+    with pytest.raises(IntegrityError):
+        await test_db.create_publication("Title", "Content", owner_id=9999)
+
+
+@pytest.mark.asyncio
+async def test_delete_publications_by_owner(test_db, sample_user):
+    """Test the bulk delete of one user's publications"""
+    other = await test_db.create_user("other", "other@example.com", "password")
+    kept = await test_db.create_publication("Kept", "Content", other.id)
+    for _ in range(3):
+        await test_db.create_publication("Title", "Content", sample_user.id)
+
+    assert await test_db.delete_publications_by_owner(sample_user.id) == 3
+    assert await test_db.delete_publications_by_owner(sample_user.id) == 0
+    assert await test_db.count_publications(sample_user.id) == 0
+    assert await test_db.get_publication(kept.id) is not None
+
+
+# ==================== SUMMARY LISTING TESTS ====================
+
+
+@pytest.mark.asyncio
+async def test_publication_summaries_skip_content(test_db, sample_user):
+    """Test that summary listings don't select the content column"""
+    await test_db.create_publication("Title", "Content", sample_user.id)
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(test_db.read_engine.sync_engine, "before_cursor_execute", record)
+    publications = await test_db.get_all_publications(summary=True)
+    by_owner = await test_db.get_publications_by_owner(sample_user.id, summary=True)
+    event.remove(test_db.read_engine.sync_engine, "before_cursor_execute", record)
+
+    assert [p.title for p in publications] == [p.title for p in by_owner] == ["Title"]
+    assert all("content" not in statement for statement in statements)
+    with pytest.raises(SQLAlchemyError):
+        publications[0].content
+
+
+# ==================== CONTENT COMPRESSION TESTS ====================
+
+
+async def search_triggers_decode(db) -> bool:
+    async with db.engine.connect() as conn:
+        return await conn.run_sync(search_decodes_content)
+
+
+async def stored_content_types(db):
+    async with db.engine.connect() as conn:
+        result = await conn.exec_driver_sql(
+            "SELECT typeof(content) FROM publications ORDER BY id"
+        )
+        return [row[0] for row in result]
+
+
+def test_content_codec_roundtrip():
+    """Test that only long, compressible content is compressed"""
+    codec = ContentCodec(threshold=100)
+    long_text = "compressible text " * 100
+
+    assert isinstance(codec.encode(long_text), bytes)
+    assert ContentCodec.decode(codec.encode(long_text)) == long_text
+    assert codec.encode("short") == "short"
+    # just above the threshold the compression overhead outweighs the savings
+    assert ContentCodec(threshold=5).encode("abcdefgh") == "abcdefgh"
+    with pytest.raises(ValueError):
+        ContentCodec("lz4")
+
+
+def test_content_codec_zstd():
+    """Test the optional zstd codec"""
+    pytest.importorskip("zstandard")
+    codec = ContentCodec("zstd", threshold=10)
+    text_value = "zstd text " * 100
+
+    assert ContentCodec.decode(codec.encode(text_value)) == text_value
+
+
+@pytest.mark.asyncio
+async def test_compressed_content_transparent(test_db, sample_user):
+    """Test that compressed content reads back as text and stays searchable"""
+    test_db.content_codec = ContentCodec(threshold=100)
+    await test_db.create_tables()  # installs the decoding search triggers
+    long_text = "compressed article body " * 100
+
+    publication = await test_db.create_publication("Long", long_text, sample_user.id)
+    await test_db.create_publication("Short", "short body", sample_user.id)
+
+    assert publication.content == long_text
+    assert (await test_db.get_publication(publication.id)).content == long_text
+    assert await stored_content_types(test_db) == ["blob", "text"]
+    publications, _ = await test_db.search_publications("article")
+    assert [p.id for p in publications] == [publication.id]
+
+    updated = await test_db.update_publication(
+        publication.id, content="rewritten paragraph " * 100
+    )
+    assert updated.content == "rewritten paragraph " * 100
+    assert (await test_db.search_publications("article"))[0] == []
+    await test_db.delete_publication(publication.id)
+    assert (await test_db.search_publications("paragraph"))[0] == []
+
+
+@pytest.mark.asyncio
+async def test_compress_existing_publications(test_db, sample_user):
+    """Test migrating stored content to compression and back"""
+    long_text = "existing article " * 100
+    publication = await test_db.create_publication("Old", long_text, sample_user.id)
+    await test_db.create_publication("Short", "short body", sample_user.id)
+
+    assert not await search_triggers_decode(test_db)
+    test_db.content_codec = ContentCodec(threshold=100)
+    assert await test_db.compress_publications(batch_size=1) == 1
+    assert await stored_content_types(test_db) == ["blob", "text"]
+    assert await search_triggers_decode(test_db)
+    migrated = await test_db.get_publication(publication.id)
+    assert migrated.content == long_text
+    assert migrated.updated_at == publication.updated_at
+    assert len((await test_db.search_publications("existing"))[0]) == 1
+
+    test_db.content_codec = None
+    assert await test_db.compress_publications() == 1
+    assert await stored_content_types(test_db) == ["text", "text"]
+    assert (await test_db.get_publication(publication.id)).content == long_text
+    assert not await search_triggers_decode(test_db)
+    assert len((await test_db.search_publications("existing"))[0]) == 1
+
+
+@pytest.mark.asyncio
+async def test_uncompressed_database_writable_by_other_clients(tmp_path):
+    """Test that without compression the triggers need no app-registered function"""
+    path = tmp_path / "plain.db"
+    db = DatabaseService(
+        f"sqlite+aiosqlite:///{path}", password_hasher=PBKDF2Hasher(iterations=1000)
+    )
+    await db.create_tables()
+    admin = await db.get_user_by_username("test_admin")
+    await db.close()
+
+    with sqlite3.connect(path) as conn:
+        conn.execute(
+            "INSERT INTO publications "
+            "(title, content, owner_id, created_at, updated_at) VALUES "
+            "('Viewer', 'added in a DB viewer', ?, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP)",
+            (admin.id,),
+        )
+        conn.execute("UPDATE publications SET content = 'edited in a viewer'")
+    db = DatabaseService(
+        f"sqlite+aiosqlite:///{path}", password_hasher=PBKDF2Hasher(iterations=1000)
+    )
+    assert len((await db.search_publications("viewer"))[0]) == 1
+    await db.close()
+
+
+# ==================== WRITE-BEHIND TESTS ====================
+
+
+@pytest.mark.asyncio
+async def test_write_behind_queue_batches():
+    """Test flushing by batch size and by timer, with failures kept per item"""
+    batches = []
+
+    async def write_batch(items):
+        batches.append(items)
+        if "bad" in items:
+            raise ValueError("bad item")
+        return [item.upper() for item in items]
+
+    queue = WriteBehindQueue(write_batch, max_batch_size=3, max_delay=0.01)
+    results = await asyncio.gather(
+        *(queue.submit(item) for item in ["a", "b", "c", "d"]),
+        return_exceptions=True,
+    )
+    assert results == ["A", "B", "C", "D"]
+    assert batches == [["a", "b", "c"], ["d"]]
+
+    results = await asyncio.gather(
+        queue.submit("e"), queue.submit("bad"), return_exceptions=True
+    )
+    assert results[0] == "E"
+    assert isinstance(results[1], ValueError)
+    await queue.close()
+
+
+@pytest.mark.asyncio
+async def test_write_behind_group_commit(tmp_path):
+    """Test that concurrent create_publication calls share a commit"""
+    db = DatabaseService(
+        f"sqlite+aiosqlite:///{tmp_path / 'write_behind.db'}",
+        password_hasher=PBKDF2Hasher(iterations=1000),
+        sqlite_profile=SQLiteProfile(),
+        write_behind_batch_size=100,
+    )
+    await db.create_tables()
+    owner = await db.get_user_by_username("test_admin")
+
+    publications = await asyncio.gather(
+        *(db.create_publication(f"Title {i}", "Content", owner.id) for i in range(50)),
+        db.create_publication("Orphan", "Content", owner_id=9999),
+        return_exceptions=True,
+    )
+
+    assert [p.title for p in publications[:50]] == [f"Title {i}" for i in range(50)]
+    assert len({p.id for p in publications[:50]}) == 50
+    assert isinstance(publications[50], IntegrityError)
+    assert db.publication_writer.stats()["items"] == 50
+    assert await db.count_publications(owner.id) == 50
+    await db.close()
+
+
+@pytest.mark.asyncio
+async def test_write_behind_in_unit_of_work(tmp_path):
+    """Test that a unit of work uses the queue until its first own write"""
+    db = DatabaseService(
+        f"sqlite+aiosqlite:///{tmp_path / 'write_behind.db'}",
+        password_hasher=PBKDF2Hasher(iterations=1000),
+        write_behind_batch_size=100,
+    )
+    await db.create_tables()
+    owner = await db.get_user_by_username("test_admin")
+
+    with pytest.raises(RuntimeError):
+        async with db.unit_of_work():
+            queued = await db.create_publication("Queued", "Content", owner.id)
+            await db.update_user(owner.id, email="new@example.com")
+            await db.create_publication("Joined", "Content", owner.id)
+            raise RuntimeError("request failed")
+
+    assert db.publication_writer.stats()["items"] == 1
+    publications = await db.get_publications_by_owner(owner.id)
+    assert [p.id for p in publications] == [queued.id]
+    assert (await db.get_user(owner.id)).email == "test_admin@example.com"
+    await db.close()
+
+
+def test_write_behind_across_event_loops(tmp_path):
+    """Test the queue with a new event loop per request, as in the Flask app"""
+    db = DatabaseService(
+        f"sqlite+aiosqlite:///{tmp_path / 'write_behind.db'}",
+        password_hasher=PBKDF2Hasher(iterations=1000),
+        write_behind_batch_size=100,
+    )
+    asyncio.run(db.create_tables())
+
+    async def request():
+        return await asyncio.gather(
+            *(db.create_publication("Title", "Content", 1) for _ in range(5))
+        )
+
+    for _ in range(3):
+        assert len(asyncio.run(request())) == 5
+    assert asyncio.run(db.count_publications()) == 15
+    asyncio.run(db.close())
+
+
+# ==================== STATEMENT CACHE TESTS ====================
+
+
+@pytest.mark.asyncio
+async def test_repeated_lookups_reuse_compiled_statements(test_db, sample_user):
+    """Test that lookups of different values are served from the compiled cache"""
+    await test_db.get_user(sample_user.id)
+    await test_db.get_user_by_username("testuser")
+    await test_db.get_publication(1)
+    await test_db.authenticate_user("testuser", "password123")
+    before = test_db.metrics.compilation_stats()
+
+    for value in range(5):
+        assert await test_db.get_user(sample_user.id + value + 1) is None
+        assert await test_db.get_user_by_username(f"nobody{value}") is None
+        assert await test_db.get_publication(value + 1) is None
+        assert await test_db.authenticate_user(f"nobody{value}", "x") is None
+    assert (await test_db.get_user_by_username("testuser")).id == sample_user.id
+
+    after = test_db.metrics.compilation_stats()
+    assert after["hit"] - before["hit"] == 21
+    assert after.get("miss", 0) == before.get("miss", 0)
+    assert 'db_compiled_cache_total{result="hit"}' in test_db.render_metrics()
+
+
+# ==================== BACKUP TESTS ====================
+
+
+@pytest.fixture(scope="session")
+def seeded_snapshot(tmp_path_factory):
+    """
+    Snapshot file of a database with users and publications, seeded once for
+    the whole test session; tests restore() it instead of seeding their own
+    """
+
+    async def seed(path):
+        db = DatabaseService(
+            "sqlite+aiosqlite:///:memory:",
+            password_hasher=PBKDF2Hasher(iterations=1000),
+        )
+        await db.create_tables()
+        user_ids = await db.create_users_bulk(
+            {"username": f"user{i}", "email": f"user{i}@example.com", "password": "x"}
+            for i in range(20)
+        )
+        await db.create_publications_bulk(
+            {"title": f"Title {i}", "content": "Content " * 100, "owner_id": user_id}
+            for i, user_id in enumerate(user_ids * 5)
+        )
+        await db.backup(path)
+        await db.close()
+
+    # the session outlives the event loops of the (function-scoped) async tests
+    path = tmp_path_factory.mktemp("snapshot") / "snapshot.db"
+    asyncio.run(seed(path))
+    return path
+
+
+@pytest.mark.asyncio
+async def test_restore_snapshot(test_db, seeded_snapshot):
+    """Test that restoring a snapshot replaces the database content"""
+    await test_db.create_user("gone", "gone@example.com", "x")
+
+    await test_db.restore(seeded_snapshot)
+
+    assert await test_db.get_user_by_username("gone") is None
+    assert (await test_db.get_user_by_username("user3")).email == "user3@example.com"
+    assert await test_db.count_publications() == 100
+    page, _ = await test_db.search_publications("Content")
+    assert len(page) == 20
+    with pytest.raises(FileNotFoundError):
+        await test_db.restore(seeded_snapshot.with_name("missing.db"))
+
+
+@pytest.mark.asyncio
+async def test_backup_in_steps_while_writing(tmp_path, seeded_snapshot):
+    """Test a stepwise backup of a file database that keeps taking writes"""
+    db = DatabaseService(
+        f"sqlite+aiosqlite:///{tmp_path / 'live.db'}",
+        password_hasher=PBKDF2Hasher(iterations=1000),
+        sqlite_profile=SQLiteProfile(),
+    )
+    await db.create_tables()
+    await db.restore(seeded_snapshot)
+    progress = []
+
+    async def write():
+        for i in range(10):
+            await db.create_publication(f"During backup {i}", "Content", 1)
+
+    await asyncio.gather(
+        db.backup(
+            tmp_path / "backup.db",
+            pages_per_step=4,
+            progress=lambda copied, total: progress.append((copied, total)),
+            step_delay=0,
+        ),
+        write(),
+    )
+    await db.close()
+
+    assert len(progress) > 1
+    assert progress[-1][0] == progress[-1][1]
+    backup = DatabaseService(f"sqlite+aiosqlite:///{tmp_path / 'backup.db'}")
+    assert await backup.count_publications() >= 100
+    assert (await backup.get_user_by_username("user0")) is not None
+    await backup.close()
+
+
+@pytest.mark.asyncio
+async def test_backup_waits_between_steps(tmp_path, seeded_snapshot):
+    """Test that step_delay is waited after every step but the last"""
+    db = DatabaseService(f"sqlite+aiosqlite:///{tmp_path / 'live.db'}")
+    await db.restore(seeded_snapshot)
+    steps = []
+
+    start = time.perf_counter()
+    await db.backup(
+        tmp_path / "backup.db",
+        pages_per_step=8,
+        progress=lambda copied, total: steps.append(copied),
+        step_delay=0.02,
+    )
+    elapsed = time.perf_counter() - start
+    await db.close()
+
+    assert len(steps) > 2
+    assert elapsed >= 0.02 * (len(steps) - 1)
+
+
+# ==================== OPTIMISTIC CONCURRENCY TESTS ====================
+
+
+@pytest.mark.asyncio
+async def test_update_publication_expected_version(test_db, sample_user):
+    """Test that updates bump the version and stale versions are rejected"""
+    publication = await test_db.create_publication("Title", "Content", sample_user.id)
+    assert publication.version == 1
+
+    updated = await test_db.update_publication(
+        publication.id, expected_version=1, title="First"
+    )
+    assert updated.version == 2
+    with pytest.raises(VersionConflict) as conflict:
+        await test_db.update_publication(
+            publication.id, expected_version=1, title="Second"
+        )
+    assert conflict.value.current_version == 2
+    with pytest.raises(VersionConflict):
+        await test_db.update_publication(publication.id, expected_version=1)
+    assert (await test_db.get_publication(publication.id)).title == "First"
+    assert (
+        await test_db.update_publication(publication.id, title="Third")
+    ).version == 3
+    assert await test_db.update_publication(9999, expected_version=1, title="x") is None
+
+
+@pytest.mark.asyncio
+async def test_concurrent_updates_single_winner(tmp_path):
+    """Test that of two editors of the same version exactly one succeeds"""
+    db = DatabaseService(
+        f"sqlite+aiosqlite:///{tmp_path / 'editors.db'}",
+        password_hasher=PBKDF2Hasher(iterations=1000),
+        sqlite_profile=SQLiteProfile(),
+    )
+    await db.create_tables()
+    owner = await db.create_user("owner", "owner@example.com", "x")
+    publication = await db.create_publication("Title", "Content", owner.id)
+
+    results = await asyncio.gather(
+        *(
+            db.update_publication(publication.id, expected_version=1, title=title)
+            for title in ("Alice", "Bob")
+        ),
+        return_exceptions=True,
+    )
+    await db.close()
+
+    conflicts = [result for result in results if isinstance(result, VersionConflict)]
+    assert len(conflicts) == 1
+    assert conflicts[0].current_version == 2
+
+
+def test_publication_etag_round_trip():
+    """Test the ETag format and the If-Match values that can't match"""
+    assert publication_etag(Publication(version=7)) == '"7"'
+    assert etag_version(' "7" ') == 7
+    for etag in ('W/"7"', "7", '"7", "8"', '""'):
+        with pytest.raises(ValueError):
+            etag_version(etag)
@@ -4,14 +4,24 @@ Demonstrates CRUD operations with authentication using FastAPI
 """
 
 from datetime import datetime
-from fastapi import FastAPI, HTTPException, Depends, Query, status
+from fastapi import FastAPI, HTTPException, Depends, Header, Query, Response, status
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from fastapi.security import HTTPBasic, HTTPBasicCredentials
 from pydantic import BaseModel, Field, EmailStr, ConfigDict
 from contextlib import asynccontextmanager
-from db import DatabaseService
+from db import (
+    DatabaseService,
+    EmailTaken,
+    SQLiteProfile,
+    UsernameTaken,
+    VersionConflict,
+    etag_version,
+    next_cursor,
+    publication_etag,
+    sqlite_read_only_url,
+)
 import db_models
 
-
 # ==================== Pydantic Models (Request/Response Schemas) ====================
 
 
@@ -35,6 +45,7 @@ class UserResponse(BaseModel):
     email: str
     is_admin: bool
     created_at: datetime
+    publication_count: int
 
 
 class PublicationCreate(BaseModel):
@@ -58,10 +69,29 @@ class PublicationResponse(BaseModel):
     updated_at: datetime
 
 
+class PublicationSummaryResponse(BaseModel):
+    """Publication without its content, for list views"""
+
+    model_config = ConfigDict(from_attributes=True)
+
+    id: int
+    title: str
+    owner_id: int
+    created_at: datetime
+    updated_at: datetime
+
+
 # ==================== Application Setup ====================
 
 
-_db_instance = DatabaseService()
+DATABASE_URL = "sqlite+aiosqlite:///./workshop.db"
+_db_instance = DatabaseService(
+    DATABASE_URL,
+    user_cache_size=1024,
+    credential_cache_size=1024,
+    sqlite_profile=SQLiteProfile(),
+    read_database_url=sqlite_read_only_url(DATABASE_URL),
+)
 
 
 @asynccontextmanager
@@ -77,22 +107,51 @@ async def lifespan(app: FastAPI):
         await _db_instance.close()
 
 
+# ==================== Dependency Injection ====================
+
+
+async def get_db() -> DatabaseService:
+    """Dependency that provides database service instance"""
+    return _db_instance
+
+
+async def unit_of_work(db: DatabaseService = Depends(get_db)):
+    """
+    Dependency running the writes of a request in one database transaction
+    (reads before the first write still use the read engine)
+    Ends (commits) before the response is sent, see `scope="function"` below
+    """
+    async with db.unit_of_work():
+        yield
+
+
 app = FastAPI(
     title="Workshop 3 - FastAPI",
     description="REST API with CRUD operations and authentication",
     version="1.0.0",
     lifespan=lifespan,
+    dependencies=[Depends(unit_of_work, scope="function")],
 )
 
 security = HTTPBasic()  # за проектите проучете нещо по-сигурно като `HTTPBearer`
 
 
-# ==================== Dependency Injection ====================
+# ==================== Helper Functions ====================
 
 
-async def get_db() -> DatabaseService:
-    """Dependency that provides database service instance"""
-    return _db_instance
+def set_next_cursor(response: Response, page, limit: int):
+    """Expose the keyset cursor of the next page (if any) as a response header"""
+    cursor = next_cursor(page, limit)
+    if cursor is not None:
+        response.headers["X-Next-Cursor"] = str(cursor)
+
+
+async def ndjson_lines(batches, response_model: type[BaseModel]):
+    """Serialize batches of rows as newline-delimited JSON while they are fetched"""
+    async for batch in batches:
+        yield "".join(
+            response_model.model_validate(row).model_dump_json() + "\n" for row in batch
+        )
 
 
 # ==================== Authentication ====================
@@ -133,27 +192,22 @@ async def create_user(user_data: UserCreate, db: DatabaseService = Depends(get_d
     """Create a new user"""
     username, email, password = user_data.username, user_data.email, user_data.password
 
-    user_with_username = await db.get_user_by_username(username)
-    if user_with_username:
+    try:
+        # always creates non-admin users
+        new_user = await db.register_user(
+            username=username, email=email, password=password
+        )
+    except UsernameTaken:
         raise HTTPException(
             status_code=400,
             detail=f"User with username {username} already exists",
         )
-
-    user_with_email = await db.get_user_by_email(email)
-    if user_with_email:
+    except EmailTaken:
         raise HTTPException(
             status_code=400,
             detail=f"User with email {email} already exists",
         )
 
-    new_user = await db.create_user(
-        username=username,
-        email=email,
-        password=password,
-        is_admin=False,  # always create non-admin users
-    )
-
     return UserResponse.model_validate(new_user)
 
 
@@ -173,13 +227,16 @@ async def get_user(
 
 @app.get("/users", response_model=list[UserResponse])
 async def get_all_users(
+    response: Response,
     skip: int = Query(0, ge=0),
     limit: int = Query(100, ge=1, le=1000),
+    after_id: int | None = Query(None, ge=0),
     current_user=Depends(require_admin_user),
     db: DatabaseService = Depends(get_db),
 ):
     """Get all users with pagination (admin only)"""
-    users = await db.get_all_users(skip=skip, limit=limit)
+    users = await db.get_all_users(skip=skip, limit=limit, after_id=after_id)
+    set_next_cursor(response, users, limit)
     return [UserResponse.model_validate(user) for user in users]
 
 
@@ -226,15 +283,160 @@ async def delete_user(
 
 # POST /publications
 
-# GET /publications/{publication_id}
 
-# GET /publications?owner_id=&skip=&limit=
+@app.get("/publications/search", response_model=list[PublicationResponse])
+async def search_publications(
+    response: Response,
+    q: str = Query(..., min_length=1),
+    limit: int = Query(20, ge=1, le=100),
+    cursor: str | None = Query(None),
+    db: DatabaseService = Depends(get_db),
+):
+    """Full-text search in publication titles and content, best matches first"""
+    try:
+        publications, next_page = await db.search_publications(
+            q, limit=limit, cursor=cursor
+        )
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+    if next_page is not None:
+        response.headers["X-Next-Cursor"] = next_page
+    return [
+        PublicationResponse.model_validate(publication) for publication in publications
+    ]
+
+
+@app.get(
+    "/publications",
+    response_model=list[PublicationResponse] | list[PublicationSummaryResponse],
+)
+async def get_all_publications(
+    response: Response,
+    owner_id: int | None = Query(None),
+    skip: int = Query(0, ge=0),
+    limit: int = Query(100, ge=1, le=1000),
+    after_id: int | None = Query(None, ge=0),
+    summary: bool = Query(False),
+    db: DatabaseService = Depends(get_db),
+):
+    """
+    Get all publications with pagination, optionally filtered by owner
+    `summary=true` leaves out the content of the publications
+    """
+    if owner_id is not None:
+        publications = await db.get_publications_by_owner(
+            owner_id, skip=skip, limit=limit, after_id=after_id, summary=summary
+        )
+    else:
+        publications = await db.get_all_publications(
+            skip=skip, limit=limit, after_id=after_id, summary=summary
+        )
+    set_next_cursor(response, publications, limit)
+    response_model = PublicationSummaryResponse if summary else PublicationResponse
+    return [response_model.model_validate(publication) for publication in publications]
+
+
+# declared after /publications/search, which it would match otherwise
+@app.get("/publications/{publication_id}", response_model=PublicationResponse)
+async def get_publication(
+    publication_id: int,
+    response: Response,
+    db: DatabaseService = Depends(get_db),
+):
+    """Get publication by ID, with its version as the ETag header"""
+    publication = await db.get_publication(publication_id)
+    if publication is None:
+        raise HTTPException(status_code=404, detail="Publication not found")
+
+    response.headers["ETag"] = publication_etag(publication)
+    return PublicationResponse.model_validate(publication)
+
+
+@app.put("/publications/{publication_id}", response_model=PublicationResponse)
+async def update_publication(
+    publication_id: int,
+    publication_data: PublicationUpdate,
+    response: Response,
+    if_match: str | None = Header(None),
+    current_user=Depends(require_current_user),
+    db: DatabaseService = Depends(get_db),
+):
+    """
+    Update publication (owner or admin)
+    With an If-Match header the update only applies to the version of that ETag
+    (412 Precondition Failed otherwise), so concurrent edits aren't lost
+    """
+    publication = await db.get_publication(publication_id)
+    if publication is None:
+        raise HTTPException(status_code=404, detail="Publication not found")
+    if publication.owner_id != current_user.id and not current_user.is_admin:
+        raise HTTPException(status_code=403, detail="Unauthorized")
+
+    update_data = publication_data.model_dump(exclude_unset=True)
+    if not update_data:
+        raise HTTPException(status_code=400, detail="No fields to update")
+
+    expected_version = None
+    if if_match is not None and if_match.strip() != "*":
+        try:
+            expected_version = etag_version(if_match)
+        except ValueError:
+            raise HTTPException(status_code=412, detail="Publication was modified")
+    try:
+        publication = await db.update_publication(
+            publication_id, expected_version=expected_version, **update_data
+        )
+    except VersionConflict:
+        raise HTTPException(status_code=412, detail="Publication was modified")
+    if publication is None:
+        raise HTTPException(status_code=404, detail="Publication not found")
+
+    response.headers["ETag"] = publication_etag(publication)
+    return PublicationResponse.model_validate(publication)
 
-# PUT /publications/{publication_id}
 
 # DELETE /publications/{publication_id}
 
 
+# ==================== METRICS ====================
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics(db: DatabaseService = Depends(get_db)):
+    """Database metrics in the Prometheus text format"""
+    return PlainTextResponse(
+        db.render_metrics(), media_type="text/plain; version=0.0.4"
+    )
+
+
+# ==================== EXPORT ENDPOINTS ====================
+
+
+@app.get("/export/users")
+async def export_users(
+    current_user=Depends(require_admin_user),
+    db: DatabaseService = Depends(get_db),
+):
+    """Export all users as NDJSON (admin only)"""
+    return StreamingResponse(
+        ndjson_lines(db.stream_users(), UserResponse),
+        media_type="application/x-ndjson",
+    )
+
+
+@app.get("/export/publications")
+async def export_publications(
+    current_user=Depends(require_admin_user),
+    db: DatabaseService = Depends(get_db),
+):
+    """Export all publications as NDJSON (admin only)"""
+    return StreamingResponse(
+        ndjson_lines(db.stream_publications(), PublicationResponse),
+        media_type="application/x-ndjson",
+    )
+
+
 if __name__ == "__main__":
     import uvicorn
 
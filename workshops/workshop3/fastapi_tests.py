@@ -5,10 +5,12 @@ Comprehensive tests for FastAPI REST API endpoints using in-memory SQLite databa
 
 import pytest
 import base64
+import json
+from sqlalchemy import event
 from httpx import AsyncClient, ASGITransport
 from fastapi_app import app, get_db
 from db import DatabaseService
-
+from passwords import PBKDF2Hasher
 
 # =========
 # FIXTURES
@@ -18,7 +20,10 @@ from db import DatabaseService
 @pytest.fixture
 async def test_db():
     """Create an in-memory database for testing"""
-    db = DatabaseService("sqlite+aiosqlite:///:memory:")
+    # a low work factor keeps password hashing from dominating the test run
+    db = DatabaseService(
+        "sqlite+aiosqlite:///:memory:", password_hasher=PBKDF2Hasher(iterations=1000)
+    )
     await db.create_tables()
     yield db
     await db.close()
@@ -103,6 +108,38 @@ async def test_create_user(client):
     assert "password" not in data  # Password should not be returned
 
 
+@pytest.mark.asyncio
+async def test_create_user_duplicate_username(client, sample_user):
+    """Test user creation with a taken username"""
+    response = await client.post(
+        "/users",
+        json={
+            "username": "testuser",
+            "email": "another@example.com",
+            "password": "secure123",
+        },
+    )
+
+    assert response.status_code == 400
+    assert "username" in response.json()["detail"]
+
+
+@pytest.mark.asyncio
+async def test_create_user_duplicate_email(client, sample_user):
+    """Test user creation with a taken email"""
+    response = await client.post(
+        "/users",
+        json={
+            "username": "anotheruser",
+            "email": "test@example.com",
+            "password": "secure123",
+        },
+    )
+
+    assert response.status_code == 400
+    assert "email" in response.json()["detail"]
+
+
 @pytest.mark.asyncio
 async def test_create_user_missing_fields(client):
     """Test user creation with missing fields"""
@@ -132,6 +169,7 @@ async def test_get_user(client, sample_user):
     data = response.json()
     assert data["id"] == sample_user.id
     assert data["username"] == "testuser"
+    assert data["publication_count"] == 0
 
 
 @pytest.mark.asyncio
@@ -192,6 +230,27 @@ async def test_get_all_users_pagination(client, admin_user):
     assert isinstance(data, list)
 
 
+@pytest.mark.asyncio
+async def test_get_all_users_cursor_pagination(client, admin_user, test_db):
+    """Test walking through users with the keyset cursor"""
+    await test_db.create_user("otheruser", "other@example.com", "pass123")
+    auth_header = get_auth_header("adminuser", "admin123")
+
+    seen_ids = []
+    url = "/users?limit=2"
+    while True:
+        response = await client.get(url, headers=auth_header)
+        assert response.status_code == 200
+        seen_ids.extend(user["id"] for user in response.json())
+        cursor = response.headers.get("X-Next-Cursor")
+        if cursor is None:
+            break
+        url = f"/users?limit=2&after_id={cursor}"
+
+    all_users = await test_db.get_all_users()
+    assert seen_ids == [user.id for user in all_users]
+
+
 @pytest.mark.asyncio
 async def test_update_user(client, sample_user):
     """Test updating user"""
@@ -207,6 +266,25 @@ async def test_update_user(client, sample_user):
     assert data["email"] == "updated@example.com"
 
 
+@pytest.mark.asyncio
+async def test_update_user_single_connection(client, sample_user, test_db):
+    """Test that the login is a read of its own and the update one transaction"""
+    checkouts = []
+    record = lambda *args: checkouts.append(args)  # noqa: E731
+    event.listen(test_db.engine.sync_engine, "checkout", record)
+    response = await client.put(
+        f"/users/{sample_user.id}",
+        headers=get_auth_header("testuser", "password123"),
+        json={"email": "updated@example.com"},
+    )
+    event.remove(test_db.engine.sync_engine, "checkout", record)
+
+    assert response.status_code == 200
+    # the read engine is the primary one in the tests
+    assert len(checkouts) == 2
+    assert (await test_db.get_user(sample_user.id)).email == "updated@example.com"
+
+
 @pytest.mark.asyncio
 async def test_update_user_unauthorized(client, sample_user, test_db):
     """Test updating another user's profile (non-admin)"""
@@ -274,4 +352,138 @@ async def test_delete_user_as_admin(client, sample_user, admin_user):
 
 # ==================== PUBLICATION TESTS ====================
 
-# TODO: Add publication tests here
+
+@pytest.mark.asyncio
+async def test_get_all_publications_cursor_pagination(client, sample_user, test_db):
+    """Test keyset pagination of publications filtered by owner"""
+    for i in range(3):
+        await test_db.create_publication(f"Title {i}", "Content", sample_user.id)
+
+    response = await client.get(f"/publications?owner_id={sample_user.id}&limit=2")
+    assert response.status_code == 200
+    first_page = response.json()
+    assert [p["title"] for p in first_page] == ["Title 0", "Title 1"]
+
+    cursor = response.headers["X-Next-Cursor"]
+    response = await client.get(
+        f"/publications?owner_id={sample_user.id}&limit=2&after_id={cursor}"
+    )
+    assert response.status_code == 200
+    assert [p["title"] for p in response.json()] == ["Title 2"]
+    assert "X-Next-Cursor" not in response.headers
+
+
+@pytest.mark.asyncio
+async def test_get_all_publications_summary(client, sample_user, test_db):
+    """Test that summary listings leave out the content"""
+    await test_db.create_publication("Title", "Long content", sample_user.id)
+
+    response = await client.get("/publications?summary=true")
+    assert response.status_code == 200
+    assert "content" not in response.json()[0]
+    assert response.json()[0]["title"] == "Title"
+
+    response = await client.get(f"/publications?owner_id={sample_user.id}")
+    assert response.json()[0]["content"] == "Long content"
+
+
+@pytest.mark.asyncio
+async def test_search_publications(client, sample_user, test_db):
+    """Test full-text search of publications"""
+    await test_db.create_publication("Python tips", "Use WAL", sample_user.id)
+
+    response = await client.get("/publications/search?q=wal")
+
+    assert response.status_code == 200
+    assert [p["title"] for p in response.json()] == ["Python tips"]
+
+
+@pytest.mark.asyncio
+async def test_search_publications_missing_query(client):
+    """Test search without a query"""
+    response = await client.get("/publications/search")
+
+    assert response.status_code in (400, 422)
+
+
+@pytest.mark.asyncio
+async def test_get_publication_etag(client, sample_publication):
+    """Test that a publication is returned with its version as the ETag"""
+    response = await client.get(f"/publications/{sample_publication.id}")
+
+    assert response.status_code == 200
+    assert response.json()["title"] == "Test Publication"
+    assert response.headers["ETag"] == '"1"'
+    assert (await client.get("/publications/9999")).status_code == 404
+
+
+@pytest.mark.asyncio
+async def test_update_publication_if_match(client, sample_publication, test_db):
+    """Test that an update with a stale If-Match ETag is rejected"""
+    auth_header = get_auth_header("testuser", "password123")
+    url = f"/publications/{sample_publication.id}"
+    etag = (await client.get(url)).headers["ETag"]
+
+    response = await client.put(
+        url, headers={**auth_header, "If-Match": etag}, json={"title": "First"}
+    )
+    assert response.status_code == 200
+    assert response.headers["ETag"] == '"2"'
+
+    # a second editor still holding the old version
+    response = await client.put(
+        url, headers={**auth_header, "If-Match": etag}, json={"title": "Second"}
+    )
+    assert response.status_code == 412
+    assert (await client.get(url)).json()["title"] == "First"
+
+    await test_db.create_user("otheruser", "other@example.com", "pass123")
+    response = await client.put(
+        url,
+        headers=get_auth_header("otheruser", "pass123"),
+        json={"title": "Hijacked"},
+    )
+    assert response.status_code == 403
+
+
+# ==================== EXPORT TESTS ====================
+
+
+@pytest.mark.asyncio
+async def test_export_publications(client, admin_user, sample_user, test_db):
+    """Test NDJSON export of all publications (admin only)"""
+    for i in range(3):
+        await test_db.create_publication(f"Title {i}", "Content", sample_user.id)
+
+    auth_header = get_auth_header("adminuser", "admin123")
+    response = await client.get("/export/publications", headers=auth_header)
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    rows = [json.loads(line) for line in response.text.splitlines()]
+    assert [row["title"] for row in rows] == ["Title 0", "Title 1", "Title 2"]
+
+
+@pytest.mark.asyncio
+async def test_export_users_non_admin(client, sample_user):
+    """Test that non-admin users cannot export users"""
+    auth_header = get_auth_header("testuser", "password123")
+    response = await client.get("/export/users", headers=auth_header)
+
+    assert response.status_code == 403
+
+
+# ==================== METRICS TESTS ====================
+
+
+@pytest.mark.asyncio
+async def test_metrics(client, sample_user):
+    """Test that /metrics exposes database metrics as Prometheus text"""
+    auth_header = get_auth_header("testuser", "password123")
+    await client.get(f"/users/{sample_user.id}", headers=auth_header)
+
+    response = await client.get("/metrics")
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    assert 'db_method_calls_total{method="get_user"} 1' in response.text
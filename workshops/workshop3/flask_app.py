@@ -4,32 +4,105 @@ Demonstrates CRUD operations with authentication using Flask
 """
 
 import asyncio
+import json
 from functools import wraps
-from flask import Flask, request, jsonify, g
+from flask import Flask, Response, request, jsonify, g
 from werkzeug.exceptions import HTTPException
 import base64
-from db import DatabaseService
-
+from db import (
+    DatabaseService,
+    EmailTaken,
+    SQLiteProfile,
+    UsernameTaken,
+    VersionConflict,
+    etag_version,
+    next_cursor,
+    publication_etag,
+    sqlite_read_only_url,
+)
 
 app = Flask(__name__)
 app.config["JSON_SORT_KEYS"] = False
 
-db = DatabaseService()
+DATABASE_URL = "sqlite+aiosqlite:///./workshop.db"
+db = DatabaseService(
+    DATABASE_URL,
+    user_cache_size=1024,
+    credential_cache_size=1024,
+    sqlite_profile=SQLiteProfile(),
+    read_database_url=sqlite_read_only_url(DATABASE_URL),
+)
+# largest page of the paginated listings (the FastAPI app has the same bound)
+MAX_PAGE_SIZE = 1000
+# largest page of search results, also as in the FastAPI app
+MAX_SEARCH_PAGE_SIZE = 100
 
 
 # ==================== Helper Functions ====================
 
 
 def async_route(f):
-    """Decorator to handle async route handlers in Flask"""
+    """
+    Decorator to handle async route handlers in Flask
+    Each handler runs in one database unit of work, so all of its writes share
+    a transaction (rolled back for error responses)
+    """
 
     @wraps(f)
     def wrapper(*args, **kwargs):
-        return asyncio.run(f(*args, **kwargs))
+        return asyncio.run(run_in_unit_of_work(f, *args, **kwargs))
 
     return wrapper
 
 
+class ErrorResponse(Exception):
+    """Carries an error response out of the unit of work, so that it rolls back"""
+
+    def __init__(self, response):
+        super().__init__(response)
+        self.response = response
+
+
+async def run_in_unit_of_work(f, *args, **kwargs):
+    """Await a route handler inside `db.unit_of_work()`"""
+    try:
+        async with db.unit_of_work():
+            result = await f(*args, **kwargs)
+            if isinstance(result, tuple) and result[1] >= 400:
+                raise ErrorResponse(result)
+            return result
+    except ErrorResponse as error:
+        return error.response
+
+
+def iterate_async(async_iterator):
+    """
+    Consume an async iterator from a regular (sync) generator
+    Flask runs streamed response bodies after the view returned, outside of
+    `async_route`, so the iterator gets its own event loop
+    """
+    loop = asyncio.new_event_loop()
+    try:
+        while True:
+            try:
+                yield loop.run_until_complete(async_iterator.__anext__())
+            except StopAsyncIteration:
+                break
+    finally:
+        loop.run_until_complete(async_iterator.aclose())
+        loop.close()
+
+
+def ndjson_response(batches, to_dict):
+    """Streamed newline-delimited JSON response, written while rows are fetched"""
+
+    def generate():
+        for batch in iterate_async(batches):
+            yield "".join(json.dumps(to_dict(row)) + "\n" for row in batch)
+
+    return Response(generate(), mimetype="application/x-ndjson")
+
+
 def get_auth_credentials():
     """Extract username and password from Basic Auth header"""
     auth_header = request.headers.get("Authorization")
@@ -54,6 +127,7 @@ def user_to_dict(user, include_password=False):
         "email": user.email,
         "is_admin": user.is_admin,
         "created_at": user.created_at.isoformat() if user.created_at else None,
+        "publication_count": user.publication_count,
     }
     if include_password:
         data["password_hash"] = user.password_hash
@@ -76,6 +150,30 @@ def publication_to_dict(publication):
     }
 
 
+def publication_summary_to_dict(publication):
+    """Convert Publication model to dictionary without its content (for lists)"""
+    return {
+        "id": publication.id,
+        "title": publication.title,
+        "owner_id": publication.owner_id,
+        "created_at": (
+            publication.created_at.isoformat() if publication.created_at else None
+        ),
+        "updated_at": (
+            publication.updated_at.isoformat() if publication.updated_at else None
+        ),
+    }
+
+
+def paginated_response(items, to_dict, limit):
+    """JSON list response with the keyset cursor of the next page (if any) as a header"""
+    response = jsonify([to_dict(item) for item in items])
+    cursor = next_cursor(items, limit)
+    if cursor is not None:
+        response.headers["X-Next-Cursor"] = str(cursor)
+    return response
+
+
 def require_auth(f):
     """Decorator to require authentication for endpoints"""
 
@@ -173,18 +271,15 @@ async def create_user():
 
     username, email, password = data["username"], data["email"], data["password"]
 
-    user_with_username = await db.get_user_by_username(username)
-    if user_with_username is not None:
+    try:
+        new_user = await db.register_user(
+            username=username, email=email, password=password
+        )
+    except UsernameTaken:
         return jsonify({"error": "Username already exists"}), 400
-
-    user_with_email = await db.get_user_by_email(email)
-    if user_with_email is not None:
+    except EmailTaken:
         return jsonify({"error": "Email already exists"}), 400
 
-    new_user = await db.create_user(
-        username=username, email=email, password=password, is_admin=False
-    )
-
     return jsonify(user_to_dict(new_user)), 201
 
 
@@ -206,9 +301,12 @@ async def get_all_users():
     """Get all users with pagination (admin only)"""
     skip = request.args.get("skip", 0, type=int)
     limit = request.args.get("limit", 100, type=int)
+    after_id = request.args.get("after_id", type=int)
+    if not 1 <= limit <= MAX_PAGE_SIZE:
+        return jsonify({"error": f"limit must be between 1 and {MAX_PAGE_SIZE}"}), 400
 
-    users = await db.get_all_users(skip=skip, limit=limit)
-    return jsonify([user_to_dict(user) for user in users])
+    users = await db.get_all_users(skip=skip, limit=limit, after_id=after_id)
+    return paginated_response(users, user_to_dict, limit)
 
 
 @app.route("/users/<int:user_id>", methods=["PUT"])
@@ -258,14 +356,151 @@ async def delete_user(user_id):
 
 # POST /publications
 
-# GET /publications/<publication_id>
 
-# GET /publications?owner_id=&skip=&limit=
+@app.route("/publications/<int:publication_id>", methods=["GET"])
+@async_route
+async def get_publication(publication_id):
+    """Get publication by ID, with its version as the ETag header"""
+    publication = await db.get_publication(publication_id)
+    if publication is None:
+        return jsonify({"error": "Publication not found"}), 404
+
+    response = jsonify(publication_to_dict(publication))
+    response.headers["ETag"] = publication_etag(publication)
+    return response
+
+
+@app.route("/publications/search", methods=["GET"])
+@async_route
+async def search_publications():
+    """Full-text search in publication titles and content, best matches first"""
+    query = request.args.get("q", "")
+    limit = request.args.get("limit", 20, type=int)
+    cursor = request.args.get("cursor")
+
+    if not query:
+        return jsonify({"error": "Query parameter q is required"}), 400
+    if not 1 <= limit <= MAX_SEARCH_PAGE_SIZE:
+        return (
+            jsonify({"error": f"limit must be between 1 and {MAX_SEARCH_PAGE_SIZE}"}),
+            400,
+        )
+
+    try:
+        publications, next_page = await db.search_publications(
+            query, limit=limit, cursor=cursor
+        )
+    except ValueError:
+        return jsonify({"error": "Invalid cursor"}), 400
+
+    response = jsonify([publication_to_dict(p) for p in publications])
+    if next_page is not None:
+        response.headers["X-Next-Cursor"] = next_page
+    return response
+
+
+@app.route("/publications", methods=["GET"])
+@async_route
+async def get_all_publications():
+    """
+    Get all publications with pagination, optionally filtered by owner
+    `summary=true` leaves out the content of the publications
+    """
+    owner_id = request.args.get("owner_id", type=int)
+    skip = request.args.get("skip", 0, type=int)
+    limit = request.args.get("limit", 100, type=int)
+    after_id = request.args.get("after_id", type=int)
+    if not 1 <= limit <= MAX_PAGE_SIZE:
+        return jsonify({"error": f"limit must be between 1 and {MAX_PAGE_SIZE}"}), 400
+    summary = request.args.get("summary", "false").lower() in ("true", "1")
+
+    if owner_id is not None:
+        publications = await db.get_publications_by_owner(
+            owner_id, skip=skip, limit=limit, after_id=after_id, summary=summary
+        )
+    else:
+        publications = await db.get_all_publications(
+            skip=skip, limit=limit, after_id=after_id, summary=summary
+        )
+    to_dict = publication_summary_to_dict if summary else publication_to_dict
+    return paginated_response(publications, to_dict, limit)
+
+
+@app.route("/publications/<int:publication_id>", methods=["PUT"])
+@async_route
+@require_auth
+async def update_publication(publication_id):
+    """
+    Update publication (owner or admin)
+    With an If-Match header the update only applies to the version of that ETag
+    (412 Precondition Failed otherwise), so concurrent edits aren't lost
+    """
+    publication = await db.get_publication(publication_id)
+    if publication is None:
+        return jsonify({"error": "Publication not found"}), 404
+    if publication.owner_id != g.current_user.id and not g.current_user.is_admin:
+        return jsonify({"error": "Unauthorized"}), 403
+
+    data = request.get_json()
+    if not data:
+        return jsonify({"error": "Request body is required"}), 400
+
+    allowed_fields = ["title", "content"]
+    update_data = {k: v for k, v in data.items() if k in allowed_fields}
+    if not update_data:
+        return jsonify({"error": "No valid fields to update"}), 400
+
+    if_match = request.headers.get("If-Match")
+    expected_version = None
+    if if_match is not None and if_match.strip() != "*":
+        try:
+            expected_version = etag_version(if_match)
+        except ValueError:
+            return jsonify({"error": "Publication was modified"}), 412
+    try:
+        publication = await db.update_publication(
+            publication_id, expected_version=expected_version, **update_data
+        )
+    except VersionConflict:
+        return jsonify({"error": "Publication was modified"}), 412
+    if publication is None:
+        return jsonify({"error": "Publication not found"}), 404
+
+    response = jsonify(publication_to_dict(publication))
+    response.headers["ETag"] = publication_etag(publication)
+    return response
 
-# PUT /publications/<publication_id>
 
 # DELETE /publications/<publication_id>
 
 
+# ==================== METRICS ====================
+
+
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    """Database metrics in the Prometheus text format"""
+    return Response(db.render_metrics(), content_type="text/plain; version=0.0.4")
+
+
+# ==================== EXPORT ENDPOINTS ====================
+
+
+@app.route("/export/users", methods=["GET"])
+@async_route
+@require_admin_auth
+async def export_users():
+    """Export all users as NDJSON (admin only)"""
+    return ndjson_response(db.stream_users(), user_to_dict)
+
+
+@app.route("/export/publications", methods=["GET"])
+@async_route
+@require_admin_auth
+async def export_publications():
+    """Export all publications as NDJSON (admin only)"""
+    return ndjson_response(db.stream_publications(), publication_to_dict)
+
+
 if __name__ == "__main__":
     app.run(debug=True, port=5000)
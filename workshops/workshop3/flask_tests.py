@@ -6,17 +6,24 @@ Comprehensive tests for Flask REST API endpoints using in-memory SQLite database
 import pytest
 import asyncio
 import base64
+import json
+from sqlalchemy import event
 from flask_app import app
 from db import DatabaseService
+from passwords import PBKDF2Hasher
 
 # =========
 # FIXTURES
 # =========
 
+
 @pytest.fixture
 async def test_db():
     """Create an in-memory database for testing"""
-    db = DatabaseService("sqlite+aiosqlite:///:memory:")
+    # a low work factor keeps password hashing from dominating the test run
+    db = DatabaseService(
+        "sqlite+aiosqlite:///:memory:", password_hasher=PBKDF2Hasher(iterations=1000)
+    )
     await db.create_tables()
     yield db
     await db.close()
@@ -29,6 +36,7 @@ def client(test_db):
 
     # replace the app's database with test database
     import flask_app
+
     flask_app.db = test_db
     # това заменя стойността на глобалната променлива `db` в модула `flask_app`
 
@@ -97,6 +105,36 @@ def test_create_user(client):
     assert "password" not in data  # Password should not be returned
 
 
+def test_create_user_duplicate_username(client, sample_user):
+    """Test user creation with a taken username"""
+    response = client.post(
+        "/users",
+        json={
+            "username": "testuser",
+            "email": "another@example.com",
+            "password": "secure123",
+        },
+    )
+
+    assert response.status_code == 400
+    assert response.get_json()["error"] == "Username already exists"
+
+
+def test_create_user_duplicate_email(client, sample_user):
+    """Test user creation with a taken email"""
+    response = client.post(
+        "/users",
+        json={
+            "username": "anotheruser",
+            "email": "test@example.com",
+            "password": "secure123",
+        },
+    )
+
+    assert response.status_code == 400
+    assert response.get_json()["error"] == "Email already exists"
+
+
 def test_create_user_missing_fields(client):
     """Test user creation with missing fields"""
     response = client.post("/users", json={"username": "newuser"})
@@ -132,6 +170,7 @@ def test_get_user(client, sample_user):
     data = response.get_json()
     assert data["id"] == sample_user.id
     assert data["username"] == "testuser"
+    assert data["publication_count"] == 0
 
 
 def test_get_user_unauthorized(client, sample_user):
@@ -168,6 +207,26 @@ def test_get_all_users_non_admin(client, sample_user):
     assert response.status_code == 403  # Forbidden for non-admin users
 
 
+def test_get_all_users_cursor_pagination(client, admin_user, test_db):
+    """Test walking through users with the keyset cursor"""
+    asyncio.run(test_db.create_user("otheruser", "other@example.com", "pass123"))
+    auth_header = get_auth_header("adminuser", "admin123")
+
+    seen_ids = []
+    url = "/users?limit=2"
+    while True:
+        response = client.get(url, headers=auth_header)
+        assert response.status_code == 200
+        seen_ids.extend(user["id"] for user in response.get_json())
+        cursor = response.headers.get("X-Next-Cursor")
+        if cursor is None:
+            break
+        url = f"/users?limit=2&after_id={cursor}"
+
+    all_users = asyncio.run(test_db.get_all_users())
+    assert seen_ids == [user.id for user in all_users]
+
+
 def test_update_user(client, sample_user):
     """Test updating user"""
     auth_header = get_auth_header("testuser", "password123")
@@ -182,6 +241,38 @@ def test_update_user(client, sample_user):
     assert data["email"] == "updated@example.com"
 
 
+def test_update_user_single_connection(client, sample_user, test_db):
+    """Test that the login is a read of its own and the update one transaction"""
+    checkouts = []
+    record = lambda *args: checkouts.append(args)  # noqa: E731
+    event.listen(test_db.engine.sync_engine, "checkout", record)
+    response = client.put(
+        f"/users/{sample_user.id}",
+        headers=get_auth_header("testuser", "password123"),
+        json={"email": "updated@example.com"},
+    )
+    event.remove(test_db.engine.sync_engine, "checkout", record)
+
+    assert response.status_code == 200
+    # the read engine is the primary one in the tests
+    assert len(checkouts) == 2
+
+
+def test_error_response_rolls_back(client, sample_user, test_db):
+    """Test that writes of a handler returning an error status are discarded"""
+    import flask_app
+
+    @flask_app.async_route
+    async def failing_handler():
+        await test_db.update_user(sample_user.id, email="changed@example.com")
+        return {"error": "Something failed"}, 400
+
+    with app.test_request_context():
+        assert failing_handler()[1] == 400
+    user = asyncio.run(test_db.get_user(sample_user.id))
+    assert user.email == "test@example.com"
+
+
 def test_update_user_unauthorized(client, sample_user, test_db):
     """Test updating another user's profile (non-admin)"""
     # Create another user
@@ -235,4 +326,141 @@ def test_delete_user_as_admin(client, sample_user, admin_user):
 # ==================== PUBLICATION TESTS ====================
 
 
-# TODO: Add publication tests here
\ No newline at end of file
+def test_get_all_publications_cursor_pagination(client, sample_user, test_db):
+    """Test keyset pagination of publications filtered by owner"""
+    for i in range(3):
+        asyncio.run(test_db.create_publication(f"Title {i}", "Content", sample_user.id))
+
+    response = client.get(f"/publications?owner_id={sample_user.id}&limit=2")
+    assert response.status_code == 200
+    assert [p["title"] for p in response.get_json()] == ["Title 0", "Title 1"]
+
+    cursor = response.headers["X-Next-Cursor"]
+    response = client.get(
+        f"/publications?owner_id={sample_user.id}&limit=2&after_id={cursor}"
+    )
+    assert response.status_code == 200
+    assert [p["title"] for p in response.get_json()] == ["Title 2"]
+    assert "X-Next-Cursor" not in response.headers
+
+    for limit in (0, -1, 1001):
+        response = client.get(f"/publications?limit={limit}")
+        assert response.status_code == 400
+
+
+def test_get_all_publications_summary(client, sample_user, test_db):
+    """Test that summary listings leave out the content"""
+    asyncio.run(test_db.create_publication("Title", "Long content", sample_user.id))
+
+    response = client.get(f"/publications?owner_id={sample_user.id}&summary=true")
+    assert response.status_code == 200
+    assert "content" not in response.get_json()[0]
+    assert response.get_json()[0]["title"] == "Title"
+
+    response = client.get("/publications")
+    assert response.get_json()[0]["content"] == "Long content"
+
+
+def test_search_publications(client, sample_user, test_db):
+    """Test full-text search of publications"""
+    asyncio.run(test_db.create_publication("Python tips", "Use WAL", sample_user.id))
+
+    response = client.get("/publications/search?q=wal")
+
+    assert response.status_code == 200
+    assert [p["title"] for p in response.get_json()] == ["Python tips"]
+
+
+@pytest.mark.parametrize("limit", [0, -5, 101])
+def test_search_publications_invalid_limit(client, limit):
+    """Test that search pages are limited to 1..100 publications"""
+    response = client.get(f"/publications/search?q=wal&limit={limit}")
+
+    assert response.status_code == 400
+    assert "limit" in response.get_json()["error"]
+
+
+def test_search_publications_missing_query(client):
+    """Test search without a query"""
+    response = client.get("/publications/search")
+
+    assert response.status_code in (400, 422)
+
+
+def test_get_publication_etag(client, sample_publication):
+    """Test that a publication is returned with its version as the ETag"""
+    response = client.get(f"/publications/{sample_publication.id}")
+
+    assert response.status_code == 200
+    assert response.get_json()["title"] == "Test Publication"
+    assert response.headers["ETag"] == '"1"'
+    assert client.get("/publications/9999").status_code == 404
+
+
+def test_update_publication_if_match(client, sample_publication, test_db):
+    """Test that an update with a stale If-Match ETag is rejected"""
+    auth_header = get_auth_header("testuser", "password123")
+    url = f"/publications/{sample_publication.id}"
+    etag = client.get(url).headers["ETag"]
+
+    response = client.put(
+        url, headers={**auth_header, "If-Match": etag}, json={"title": "First"}
+    )
+    assert response.status_code == 200
+    assert response.headers["ETag"] == '"2"'
+
+    # a second editor still holding the old version
+    response = client.put(
+        url, headers={**auth_header, "If-Match": etag}, json={"title": "Second"}
+    )
+    assert response.status_code == 412
+    assert client.get(url).get_json()["title"] == "First"
+
+    asyncio.run(test_db.create_user("otheruser", "other@example.com", "pass123"))
+    response = client.put(
+        url,
+        headers=get_auth_header("otheruser", "pass123"),
+        json={"title": "Hijacked"},
+    )
+    assert response.status_code == 403
+
+
+# ==================== EXPORT TESTS ====================
+
+
+def test_export_publications(client, admin_user, sample_user, test_db):
+    """Test NDJSON export of all publications (admin only)"""
+    for i in range(3):
+        asyncio.run(test_db.create_publication(f"Title {i}", "Content", sample_user.id))
+
+    auth_header = get_auth_header("adminuser", "admin123")
+    response = client.get("/export/publications", headers=auth_header)
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    rows = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    assert [row["title"] for row in rows] == ["Title 0", "Title 1", "Title 2"]
+
+
+def test_export_users_non_admin(client, sample_user):
+    """Test that non-admin users cannot export users"""
+    auth_header = get_auth_header("testuser", "password123")
+    response = client.get("/export/users", headers=auth_header)
+
+    assert response.status_code == 403
+
+
+# ==================== METRICS TESTS ====================
+
+
+def test_metrics(client, sample_user):
+    """Test that /metrics exposes database metrics as Prometheus text"""
+    auth_header = get_auth_header("testuser", "password123")
+    client.get(f"/users/{sample_user.id}", headers=auth_header)
+
+    response = client.get("/metrics")
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    body = response.get_data(as_text=True)
+    assert 'db_method_calls_total{method="get_user"} 1' in body
@@ -0,0 +1,91 @@
+"""
+DataLoader-style request coalescing
+Keys requested in the same event loop iteration are loaded with one batched query,
+so N concurrent lookups cost one SELECT ... WHERE key IN (...) instead of N
+"""
+
+import asyncio
+import contextvars
+import threading
+from typing import Any, Awaitable, Callable, Hashable, Mapping
+
+
+class _Batch:
+    """Keys collected on one event loop, each with the future its callers await"""
+
+    def __init__(self, loop: asyncio.AbstractEventLoop):
+        self.loop = loop
+        self.futures: dict[Hashable, asyncio.Future] = {}
+
+
+class BatchLoader:
+    """Coalesces concurrent `load(key)` calls into calls of `load_batch(keys)`"""
+
+    def __init__(
+        self,
+        load_batch: Callable[[list[Any]], Awaitable[Mapping[Any, Any]]],
+        max_batch_size: int = 500,
+    ):
+        """
+        Args:
+            load_batch: Loads distinct keys and returns {key: value}; missing keys
+                load as None
+            max_batch_size: Maximum keys per `load_batch` call (SQLite limits the
+                number of bound parameters)
+        """
+        if max_batch_size < 1:
+            raise ValueError("max_batch_size must be at least 1")
+        self._load_batch = load_batch
+        self.max_batch_size = max_batch_size
+        # Flask runs every request in its own event loop, possibly on several
+        # threads, so the pending batch belongs to a thread and its running loop
+        self._local = threading.local()
+        self._tasks: set[asyncio.Task] = set()
+        self.loads = 0
+        self.batches = 0
+
+    async def load(self, key: Hashable) -> Any | None:
+        """Value of `key`, loaded together with the other keys of this loop iteration"""
+        loop = asyncio.get_running_loop()
+        batch = getattr(self._local, "batch", None)
+        if batch is None or batch.loop is not loop:
+            batch = self._local.batch = _Batch(loop)
+            # runs after the callbacks already scheduled for this iteration, i.e.
+            # after every task started together with this one had a chance to join.
+            # The empty context keeps the batch query out of the caller's metrics
+            loop.call_soon(self._dispatch, batch, context=contextvars.Context())
+
+        self.loads += 1
+        future = batch.futures.get(key)
+        if future is None:
+            future = batch.futures[key] = loop.create_future()
+            if len(batch.futures) >= self.max_batch_size:
+                self._local.batch = None
+        # a cancelled caller must not cancel the result shared with duplicates
+        return await asyncio.shield(future)
+
+    def _dispatch(self, batch: _Batch):
+        if getattr(self._local, "batch", None) is batch:
+            self._local.batch = None
+        task = batch.loop.create_task(self._run(batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, batch: _Batch):
+        self.batches += 1
+        try:
+            values = await self._load_batch(list(batch.futures))
+        except BaseException as error:
+            for future in batch.futures.values():
+                if not future.done():
+                    future.set_exception(error)
+            if not isinstance(error, Exception):
+                raise
+            return
+        for key, future in batch.futures.items():
+            if not future.done():
+                future.set_result(values.get(key))
+
+    def stats(self) -> dict[str, int]:
+        """Number of loaded keys and of batches they were loaded in"""
+        return {"loads": self.loads, "batches": self.batches}
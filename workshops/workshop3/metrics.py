@@ -0,0 +1,217 @@
+"""
+Per-method query metrics for DatabaseService in Prometheus text format
+Records a latency histogram, call/error counts, returned rows and the number of
+SQL statements each call executed, plus hits and misses of SQLAlchemy's cache of
+compiled statements
+"""
+
+import functools
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+
+# upper bounds (seconds) of the latency histogram buckets
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+
+# statement counter of the instrumented call running in the current task
+_statement_counter: ContextVar[list[int] | None] = ContextVar(
+    "statement_counter", default=None
+)
+
+
+def count_statement(*args):
+    """
+    Engine "before_cursor_execute" event handler
+    SQLAlchemy runs it inside the calling task's context, so concurrent calls
+    each count only their own statements
+    """
+    counter = _statement_counter.get()
+    if counter is not None:
+        counter[0] += 1
+
+
+def _count_rows(result) -> int:
+    """Number of rows in a DatabaseService return value"""
+    if isinstance(result, tuple):  # (page, cursor)
+        result = result[0]
+    if result is None or isinstance(result, (bool, int)):
+        return 0
+    if hasattr(result, "__len__"):
+        return len(result)
+    return 1
+
+
+class MethodStats:
+    """Counters of a single method"""
+
+    def __init__(self, bucket_count: int):
+        # the last bucket is +Inf
+        self.buckets = [0] * (bucket_count + 1)
+        self.duration_sum = 0.0
+        self.calls = 0
+        self.errors = 0
+        self.rows = 0
+        self.statements = 0
+
+
+class QueryMetrics:
+    """Thread-safe registry of per-method statistics"""
+
+    def __init__(self, buckets: tuple[float, ...] = DEFAULT_BUCKETS):
+        self.bucket_bounds = buckets
+        self._methods: dict[str, MethodStats] = {}
+        # executed statements by outcome of the compiled statement cache lookup
+        self._compilations: dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def observe(
+        self, method: str, seconds: float, rows: int, statements: int, error: bool
+    ):
+        """Record one finished call"""
+        with self._lock:
+            stats = self._methods.get(method)
+            if stats is None:
+                stats = self._methods[method] = MethodStats(len(self.bucket_bounds))
+            stats.buckets[bisect_left(self.bucket_bounds, seconds)] += 1
+            stats.duration_sum += seconds
+            stats.calls += 1
+            stats.errors += error
+            stats.rows += rows
+            stats.statements += statements
+
+    def count_compilation(
+        self, conn, cursor, statement, parameters, context, executemany
+    ):
+        """
+        Engine "before_cursor_execute" event handler
+        Counts whether the statement's compiled form came from the engine's cache,
+        e.g. "hit", "miss" or "no_cache_key" for plain SQL strings
+        """
+        result = context.cache_hit.name.lower().removeprefix("cache_")
+        with self._lock:
+            self._compilations[result] = self._compilations.get(result, 0) + 1
+
+    def compilation_stats(self) -> dict[str, int]:
+        """Executed statements by compiled cache outcome, e.g. {"hit": 10, "miss": 2}"""
+        with self._lock:
+            return dict(self._compilations)
+
+    def snapshot(self) -> dict[str, dict[str, float]]:
+        """Plain counters per method (without the histogram)"""
+        with self._lock:
+            return {
+                method: {
+                    "calls": stats.calls,
+                    "errors": stats.errors,
+                    "rows": stats.rows,
+                    "statements": stats.statements,
+                    "duration_sum": stats.duration_sum,
+                }
+                for method, stats in self._methods.items()
+            }
+
+    def render(self) -> str:
+        """All metrics in the Prometheus text exposition format"""
+        lines = [
+            "# HELP db_method_duration_seconds Latency of DatabaseService methods",
+            "# TYPE db_method_duration_seconds histogram",
+        ]
+        counters = {
+            "calls": "Calls of DatabaseService methods",
+            "errors": "Calls that raised an exception",
+            "rows": "Rows returned by DatabaseService methods",
+            "statements": "SQL statements executed by DatabaseService methods",
+        }
+        bounds = [str(bound) for bound in self.bucket_bounds] + ["+Inf"]
+        with self._lock:
+            methods = sorted(self._methods.items())
+            for method, stats in methods:
+                labels = f'method="{method}"'
+                cumulative = 0
+                for bound, count in zip(bounds, stats.buckets):
+                    cumulative += count
+                    lines.append(
+                        _sample(
+                            "db_method_duration_seconds_bucket",
+                            f'{labels},le="{bound}"',
+                            cumulative,
+                        )
+                    )
+                lines.append(
+                    _sample(
+                        "db_method_duration_seconds_sum", labels, stats.duration_sum
+                    )
+                )
+                lines.append(
+                    _sample("db_method_duration_seconds_count", labels, stats.calls)
+                )
+            for name, help_text in counters.items():
+                lines.append(f"# HELP db_method_{name}_total {help_text}")
+                lines.append(f"# TYPE db_method_{name}_total counter")
+                for method, stats in methods:
+                    lines.append(
+                        _sample(
+                            f"db_method_{name}_total",
+                            f'method="{method}"',
+                            getattr(stats, name),
+                        )
+                    )
+            lines.append(
+                "# HELP db_compiled_cache_total Executed statements by compiled "
+                "statement cache outcome"
+            )
+            lines.append("# TYPE db_compiled_cache_total counter")
+            for result, count in sorted(self._compilations.items()):
+                lines.append(
+                    _sample("db_compiled_cache_total", f'result="{result}"', count)
+                )
+        return "\n".join(lines) + "\n"
+
+
+def render_cache_metrics(caches: dict) -> str:
+    """Prometheus text for TTLCache statistics, e.g. {"user": TTLCache, ...}"""
+    lines = []
+    for stat, metric, kind in [
+        ("hits", "db_cache_hits_total", "counter"),
+        ("misses", "db_cache_misses_total", "counter"),
+        ("size", "db_cache_size", "gauge"),
+    ]:
+        lines.append(f"# TYPE {metric} {kind}")
+        for name, cache in caches.items():
+            lines.append(_sample(metric, f'cache="{name}"', cache.stats()[stat]))
+    return "\n".join(lines) + "\n"
+
+
+def _sample(metric: str, labels: str, value) -> str:
+    return f"{metric}{{{labels}}} {value}"
+
+
+def instrumented(method):
+    """Decorator recording metrics of an async DatabaseService method in `self.metrics`"""
+
+    @functools.wraps(method)
+    async def wrapper(self, *args, **kwargs):
+        outer_counter = _statement_counter.get()
+        counter = [0]
+        token = _statement_counter.set(counter)
+        result = None
+        error = False
+        start = time.perf_counter()
+        try:
+            result = await method(self, *args, **kwargs)
+            return result
+        except BaseException:
+            error = True
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            _statement_counter.reset(token)
+            # statements of nested calls also count for the calling method
+            if outer_counter is not None:
+                outer_counter[0] += counter[0]
+            self.metrics.observe(
+                method.__name__, elapsed, _count_rows(result), counter[0], error
+            )
+
+    return wrapper
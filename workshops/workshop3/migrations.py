@@ -0,0 +1,196 @@
+"""
+Versioned schema migrations for existing databases
+`Base.metadata.create_all` only creates missing tables, so changes to tables that
+already exist are applied here. The schema version is SQLite's `PRAGMA user_version`
+"""
+
+from typing import Callable
+from sqlalchemy import Connection
+
+
+def _add_publication_indexes(conn: Connection):
+    """Indexes for per-owner listings and ordering by creation time"""
+    conn.exec_driver_sql(
+        "CREATE INDEX IF NOT EXISTS ix_publications_owner_id_id "
+        "ON publications (owner_id, id)"
+    )
+    conn.exec_driver_sql(
+        "CREATE INDEX IF NOT EXISTS ix_publications_created_at "
+        "ON publications (created_at)"
+    )
+
+
+def _add_publication_search(conn: Connection):
+    """
+    FTS5 index over publication titles and content
+    It is an external-content table (the text lives only in `publications`),
+    kept in sync by triggers; title matches weigh 10x more in the bm25 rank
+    """
+    conn.exec_driver_sql(
+        "CREATE VIRTUAL TABLE IF NOT EXISTS publications_fts USING fts5("
+        "title, content, content='publications', content_rowid='id', "
+        "tokenize='unicode61 remove_diacritics 2')"
+    )
+    conn.exec_driver_sql(
+        "INSERT INTO publications_fts(publications_fts, rank) "
+        "VALUES ('rank', 'bm25(10.0, 1.0)')"
+    )
+    _create_search_triggers(conn, decode_content=False)
+    # index the publications that existed before the migration
+    conn.exec_driver_sql(
+        "INSERT INTO publications_fts(publications_fts) VALUES ('rebuild')"
+    )
+
+
+def _create_search_triggers(conn: Connection, decode_content: bool):
+    """
+    (Re)create the triggers keeping publications_fts in sync with publications
+    With `decode_content` they index the text of compressed content (see
+    db_models.ContentCodec) through the `publication_content` SQL function.
+    Only DatabaseService registers it, so other SQLite clients can't write
+    publications while these triggers are installed
+    """
+    content = "publication_content({}.content)" if decode_content else "{}.content"
+    new_content, old_content = content.format("new"), content.format("old")
+    for trigger in ("insert", "delete", "update"):
+        conn.exec_driver_sql(f"DROP TRIGGER IF EXISTS publications_fts_{trigger}")
+    conn.exec_driver_sql(
+        "CREATE TRIGGER publications_fts_insert "
+        "AFTER INSERT ON publications BEGIN "
+        "INSERT INTO publications_fts(rowid, title, content) "
+        f"VALUES (new.id, new.title, {new_content}); "
+        "END"
+    )
+    conn.exec_driver_sql(
+        "CREATE TRIGGER publications_fts_delete "
+        "AFTER DELETE ON publications BEGIN "
+        "INSERT INTO publications_fts(publications_fts, rowid, title, content) "
+        f"VALUES ('delete', old.id, old.title, {old_content}); "
+        "END"
+    )
+    conn.exec_driver_sql(
+        "CREATE TRIGGER publications_fts_update "
+        "AFTER UPDATE OF title, content ON publications BEGIN "
+        "INSERT INTO publications_fts(publications_fts, rowid, title, content) "
+        f"VALUES ('delete', old.id, old.title, {old_content}); "
+        "INSERT INTO publications_fts(rowid, title, content) "
+        f"VALUES (new.id, new.title, {new_content}); "
+        "END"
+    )
+
+
+def _add_publication_counters(conn: Connection):
+    """`users.publication_count`, maintained by triggers and backfilled once"""
+    columns = {row.name for row in conn.exec_driver_sql("PRAGMA table_info(users)")}
+    if "publication_count" not in columns:
+        conn.exec_driver_sql(
+            "ALTER TABLE users "
+            "ADD COLUMN publication_count INTEGER NOT NULL DEFAULT 0"
+        )
+    conn.exec_driver_sql(
+        "CREATE TRIGGER IF NOT EXISTS users_publication_count_insert "
+        "AFTER INSERT ON publications BEGIN "
+        "UPDATE users SET publication_count = publication_count + 1 "
+        "WHERE id = new.owner_id; "
+        "END"
+    )
+    conn.exec_driver_sql(
+        "CREATE TRIGGER IF NOT EXISTS users_publication_count_delete "
+        "AFTER DELETE ON publications BEGIN "
+        "UPDATE users SET publication_count = publication_count - 1 "
+        "WHERE id = old.owner_id; "
+        "END"
+    )
+    conn.exec_driver_sql(
+        "CREATE TRIGGER IF NOT EXISTS users_publication_count_update "
+        "AFTER UPDATE OF owner_id ON publications "
+        "WHEN old.owner_id != new.owner_id BEGIN "
+        "UPDATE users SET publication_count = publication_count - 1 "
+        "WHERE id = old.owner_id; "
+        "UPDATE users SET publication_count = publication_count + 1 "
+        "WHERE id = new.owner_id; "
+        "END"
+    )
+    conn.exec_driver_sql(
+        "UPDATE users SET publication_count = "
+        "(SELECT COUNT(*) FROM publications WHERE owner_id = users.id)"
+    )
+
+
+def _add_publication_versions(conn: Connection):
+    """`publications.version` for conditional updates, starting at 1"""
+    columns = {
+        row.name for row in conn.exec_driver_sql("PRAGMA table_info(publications)")
+    }
+    if "version" not in columns:
+        conn.exec_driver_sql(
+            "ALTER TABLE publications ADD COLUMN version INTEGER NOT NULL DEFAULT 1"
+        )
+
+
+# (version, migration) pairs in the order they have to be applied
+MIGRATIONS: list[tuple[int, Callable[[Connection], None]]] = [
+    (1, _add_publication_indexes),
+    (2, _add_publication_search),
+    (3, _add_publication_counters),
+    (4, _add_publication_versions),
+]
+
+# tables created by migrations instead of the ORM models
+MIGRATION_TABLES = ["publications_fts"]
+
+
+def get_schema_version(conn: Connection) -> int:
+    """Schema version stored in the database file"""
+    return conn.exec_driver_sql("PRAGMA user_version").scalar_one()
+
+
+def migrate(conn: Connection) -> int:
+    """
+    Apply all pending migrations inside the caller's transaction
+    Migrations also run on freshly created databases, so they must be idempotent
+    Returns:
+        The new schema version
+    """
+    version = get_schema_version(conn)
+    for target_version, migration in MIGRATIONS:
+        if target_version > version:
+            migration(conn)
+            conn.exec_driver_sql(f"PRAGMA user_version = {target_version}")
+            version = target_version
+    return version
+
+
+def search_decodes_content(conn: Connection) -> bool:
+    """Whether the installed search triggers decode compressed content"""
+    trigger_sql = conn.exec_driver_sql(
+        "SELECT sql FROM sqlite_master "
+        "WHERE type = 'trigger' AND name = 'publications_fts_insert'"
+    ).scalar()
+    return trigger_sql is not None and "publication_content(" in trigger_sql
+
+
+def use_search_triggers(conn: Connection, compression: bool):
+    """
+    Install the search triggers that decode compressed content while compression
+    is used, and the plain ones, which any SQLite client can run, once no
+    compressed content is left
+    """
+    decoding = search_decodes_content(conn)
+    if decoding and not compression:
+        # content compressed earlier is indexed as text until it is decompressed
+        compression = bool(
+            conn.exec_driver_sql(
+                "SELECT EXISTS "
+                "(SELECT 1 FROM publications WHERE typeof(content) = 'blob')"
+            ).scalar_one()
+        )
+    if compression != decoding:
+        _create_search_triggers(conn, decode_content=compression)
+
+
+def reset_migrations(conn: Connection):
+    """Drop the tables created by migrations and mark the database as unmigrated"""
+    for table in MIGRATION_TABLES:
+        conn.exec_driver_sql(f"DROP TABLE IF EXISTS {table}")
+    conn.exec_driver_sql("PRAGMA user_version = 0")
@@ -0,0 +1,128 @@
+"""
+Password hashing with a configurable work factor
+Hashes are stored as "<algorithm>$<parameters>$<salt>$<hash>", so hashes made with
+older parameters (or the legacy unsalted sha256 hex digests) keep verifying
+"""
+
+import base64
+import hashlib
+import hmac
+import os
+from abc import ABC, abstractmethod
+
+
+def _b64encode(data: bytes) -> str:
+    return base64.b64encode(data).decode("ascii")
+
+
+def _b64decode(data: str) -> bytes:
+    return base64.b64decode(data.encode("ascii"))
+
+
+class PasswordHasher(ABC):
+    """Base class for password hashing algorithms"""
+
+    algorithm = ""
+
+    @abstractmethod
+    def hash(self, password: str) -> str:
+        """Hash a password with a fresh random salt"""
+
+    @abstractmethod
+    def verify(self, password: str, encoded: str) -> bool:
+        """Check a password against a hash produced by this algorithm"""
+
+    @abstractmethod
+    def needs_rehash(self, encoded: str) -> bool:
+        """Whether a stored hash was made by another algorithm or with other parameters"""
+
+
+class PBKDF2Hasher(PasswordHasher):
+    """PBKDF2-HMAC-SHA256 (the OWASP recommendation is 600 000 iterations)"""
+
+    algorithm = "pbkdf2_sha256"
+
+    def __init__(self, iterations: int = 600_000):
+        self.iterations = iterations
+
+    def _derive(self, password: str, salt: bytes, iterations: int) -> bytes:
+        return hashlib.pbkdf2_hmac("sha256", password.encode(), salt, iterations)
+
+    def hash(self, password: str) -> str:
+        salt = os.urandom(16)
+        derived = self._derive(password, salt, self.iterations)
+        return f"{self.algorithm}${self.iterations}${_b64encode(salt)}${_b64encode(derived)}"
+
+    def verify(self, password: str, encoded: str) -> bool:
+        _, iterations, salt, expected = encoded.split("$")
+        derived = self._derive(password, _b64decode(salt), int(iterations))
+        return hmac.compare_digest(derived, _b64decode(expected))
+
+    def needs_rehash(self, encoded: str) -> bool:
+        return not encoded.startswith(f"{self.algorithm}${self.iterations}$")
+
+
+class ScryptHasher(PasswordHasher):
+    """scrypt - memory-hard, so it is also expensive to attack on GPUs"""
+
+    algorithm = "scrypt"
+
+    def __init__(self, n: int = 2**14, r: int = 8, p: int = 1):
+        self.n = n
+        self.r = r
+        self.p = p
+
+    def _derive(self, password: str, salt: bytes, n: int, r: int, p: int) -> bytes:
+        # scrypt needs ~128 * n * r bytes, leave some headroom above that
+        maxmem = 130 * n * r * p + 1024 * 1024
+        return hashlib.scrypt(
+            password.encode(), salt=salt, n=n, r=r, p=p, maxmem=maxmem, dklen=32
+        )
+
+    def hash(self, password: str) -> str:
+        salt = os.urandom(16)
+        derived = self._derive(password, salt, self.n, self.r, self.p)
+        return (
+            f"{self.algorithm}${self.n}${self.r}${self.p}"
+            f"${_b64encode(salt)}${_b64encode(derived)}"
+        )
+
+    def verify(self, password: str, encoded: str) -> bool:
+        _, n, r, p, salt, expected = encoded.split("$")
+        derived = self._derive(password, _b64decode(salt), int(n), int(r), int(p))
+        return hmac.compare_digest(derived, _b64decode(expected))
+
+    def needs_rehash(self, encoded: str) -> bool:
+        return not encoded.startswith(f"{self.algorithm}${self.n}${self.r}${self.p}$")
+
+
+class LegacySHA256Hasher(PasswordHasher):
+    """Unsalted sha256 hex digest used by the first version of the workshop"""
+
+    algorithm = "sha256"
+
+    def hash(self, password: str) -> str:
+        return hashlib.sha256(password.encode()).hexdigest()
+
+    def verify(self, password: str, encoded: str) -> bool:
+        return hmac.compare_digest(self.hash(password), encoded)
+
+    def needs_rehash(self, encoded: str) -> bool:
+        return "$" in encoded
+
+
+HASHERS: dict[str, type[PasswordHasher]] = {
+    PBKDF2Hasher.algorithm: PBKDF2Hasher,
+    ScryptHasher.algorithm: ScryptHasher,
+}
+
+
+def verify_password(password: str, encoded: str) -> bool:
+    """Verify a password against a stored hash of any supported algorithm"""
+    if "$" not in encoded:
+        return LegacySHA256Hasher().verify(password, encoded)
+
+    algorithm = encoded.split("$", 1)[0]
+    if algorithm not in HASHERS:
+        raise ValueError(f"Unknown password hash algorithm: {algorithm}")
+    return HASHERS[algorithm]().verify(password, encoded)
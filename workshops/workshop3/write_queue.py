@@ -0,0 +1,129 @@
+"""
+Write-behind queue with group commit
+Concurrent inserts are handed to a single writer task that writes them in
+batches, one transaction (and one fsync) per batch instead of one per row
+"""
+
+import asyncio
+import contextvars
+import threading
+from typing import Any, Awaitable, Callable, Sequence
+
+
+class _Writer:
+    """Queue and writer task of one event loop"""
+
+    def __init__(self, loop: asyncio.AbstractEventLoop):
+        self.loop = loop
+        self.queue: asyncio.Queue[tuple[Any, asyncio.Future]] = asyncio.Queue()
+        self.full = asyncio.Event()
+        self.task: asyncio.Task | None = None
+
+
+class WriteBehindQueue:
+    """Collects `submit(item)` calls and writes them with `write_batch(items)`"""
+
+    def __init__(
+        self,
+        write_batch: Callable[[list[Any]], Awaitable[Sequence[Any]]],
+        max_batch_size: int = 500,
+        max_delay: float = 0.005,
+    ):
+        """
+        Args:
+            write_batch: Writes the items in one transaction and returns one result
+                per item, in order
+            max_batch_size: A batch is written as soon as it has this many items
+            max_delay: Seconds the first item of a batch waits for more items
+        """
+        if max_batch_size < 1:
+            raise ValueError("max_batch_size must be at least 1")
+        self._write_batch = write_batch
+        self.max_batch_size = max_batch_size
+        self.max_delay = max_delay
+        # like BatchLoader: Flask runs every request in its own event loop
+        self._local = threading.local()
+        self.items = 0
+        self.batches = 0
+
+    def _writer(self) -> _Writer:
+        loop = asyncio.get_running_loop()
+        writer = getattr(self._local, "writer", None)
+        if writer is None or writer.loop is not loop:
+            writer = self._local.writer = _Writer(loop)
+        if writer.task is None or writer.task.done():
+            # an empty context keeps the writes out of the first caller's metrics
+            writer.task = loop.create_task(
+                self._run(writer), context=contextvars.Context()
+            )
+        return writer
+
+    async def submit(self, item: Any) -> Any:
+        """
+        Queue an item and wait until the batch containing it is committed
+        Returns:
+            The item's result from `write_batch`
+        """
+        writer = self._writer()
+        future = writer.loop.create_future()
+        writer.queue.put_nowait((item, future))
+        # the writer already took the first item of the batch off the queue
+        if writer.queue.qsize() >= self.max_batch_size - 1:
+            writer.full.set()
+        # the item is written even if the caller is cancelled meanwhile
+        return await asyncio.shield(future)
+
+    async def _run(self, writer: _Writer):
+        while True:
+            batch = [await writer.queue.get()]
+            if writer.queue.qsize() + 1 < self.max_batch_size:
+                writer.full.clear()
+                try:
+                    await asyncio.wait_for(writer.full.wait(), self.max_delay)
+                except TimeoutError:
+                    pass
+            while len(batch) < self.max_batch_size and not writer.queue.empty():
+                batch.append(writer.queue.get_nowait())
+            try:
+                await self._flush(batch)
+            except asyncio.CancelledError:
+                # the loop is shutting down in the middle of a write
+                for _, future in batch:
+                    future.cancel()
+                raise
+            finally:
+                for _ in batch:
+                    writer.queue.task_done()
+
+    async def _flush(self, batch: list[tuple[Any, asyncio.Future]]):
+        self.batches += 1
+        try:
+            results = await self._write_batch([item for item, _ in batch])
+        except Exception as error:
+            if len(batch) == 1:
+                future = batch[0][1]
+                if not future.done():
+                    future.set_exception(error)
+                return
+            # one bad item must not fail the others: retry them one at a time
+            for entry in batch:
+                await self._flush([entry])
+            return
+        self.items += len(batch)
+        for (_, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
+
+    async def close(self):
+        """Wait for the queued items to be written and stop the running loop's writer"""
+        writer = getattr(self._local, "writer", None)
+        if writer is None or writer.loop is not asyncio.get_running_loop():
+            return
+        await writer.queue.join()
+        if writer.task is not None:
+            writer.task.cancel()
+        self._local.writer = None
+
+    def stats(self) -> dict[str, int]:
+        """Number of written items and of (attempted) batches"""
+        return {"items": self.items, "batches": self.batches}